@@ -0,0 +1,78 @@
+# coding: utf-8
+
+"""
+Shared helpers for benchmark scripts. Every benchmark prints one JSON
+record per line, so that results can be stored and compared over time.
+"""
+
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+
+def measure(fn, repeat=10, setup=None):
+    """
+    Calls `fn` `repeat` times (after `setup`, if given, which isn't timed)
+    and returns timing statistics in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {"repeat": repeat,
+            "mean_ms": sum(times) / len(times),
+            "min_ms": times[0],
+            "median_ms": times[len(times) // 2],
+            "max_ms": times[-1]}
+
+
+# streams records are written to and fields added to every record,
+# see benchmarks/run.py
+OUTPUTS = [sys.stdout]
+RUN_INFO = {}
+
+
+def emit(benchmark, **fields):
+    record = {"benchmark": benchmark,
+              "timestamp": str(datetime.now()),
+              "python": platform.python_version()}
+    record.update(RUN_INFO)
+    record.update(fields)
+    for out in OUTPUTS:
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+    return record
+
+
+def throughput(fn, n_items):
+    """
+    Calls `fn` once and returns items per second given that it processes
+    `n_items` items
+    """
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return {"items": n_items, "seconds": elapsed,
+            "items_per_s": n_items / elapsed if elapsed else float('inf')}
+
+
+def make_experiment_doc(n_sessions, n_epochs=10, exp_id="bench"):
+    """
+    Builds a db document in casket's layout with `n_sessions` sessions
+    """
+    sessions = []
+    for i in range(n_sessions):
+        epochs = [{"epoch_num": e, "loss": 1.0 / (e + 1), "acc": e / 10.0}
+                  for e in range(n_epochs)]
+        sessions.append({"params": {"lr": i, "seed": i % 5},
+                         "meta": {"commit": "abcdef0", "user": "bench"},
+                         "result": {"epochs": epochs}})
+    return {"_default": {"1": {"id": exp_id, "tags": [], "created": "",
+                               "models": [{"modelId": "model",
+                                           "sessions": sessions}]}}}
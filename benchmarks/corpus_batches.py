@@ -0,0 +1,155 @@
+# coding: utf-8
+
+"""
+Throughput (instances per second) of Corpus.generate_batches over a
+synthetic text corpus, in char and word mode, and of the NumPy paths
+(Corpus.generate_arrays and Corpus.generate_array_batches, with and
+without shuffling, encoding a file with several processes and reading
+from a pre-encoded cache) if NumPy is installed. Background prefetching
+(Corpus.prefetch) is compared with synchronous batches for a consumer
+spending --step-ms per batch, standing for a training step.
+
+    $ python benchmarks/corpus_batches.py --lines 2000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+
+from casket.nlp_utils import Corpus, Indexer
+
+from common import throughput, emit
+
+
+def make_lines(n_lines, words_per_line=12, seed=1001):
+    rng = random.Random(seed)
+    alphabet = string.ascii_lowercase
+    lines = []
+    for _ in range(n_lines):
+        words = [''.join(rng.choice(alphabet)
+                         for _ in range(rng.randint(2, 9)))
+                 for _ in range(words_per_line)]
+        lines.append(' '.join(words) + '\n')
+    return lines
+
+
+def consume(batches):
+    return sum(len(targets) for _, targets in batches)
+
+
+def consume_steps(batches, step_ms):
+    n = 0
+    for _, targets in batches:
+        n += len(targets)
+        time.sleep(step_ms / 1000.)     # releases the GIL, as training
+    return n
+
+
+def consume_arrays(arrays):
+    return sum(len(targets) for _, targets in arrays)
+
+
+def run(lines=2000, context=10, batch_size=128, jobs=None, step_ms=1.0):
+    text = make_lines(lines)
+    for mode in ('chars', 'words'):
+        indexer = Indexer()
+        units = (c for line in text for c in line) if mode == 'chars' else \
+            (w for line in text for w in line.split())
+        indexer.fit(units)
+        corpus = Corpus((line for line in text), context=context)
+        n_items = sum(len(line) for line in text) if mode == 'chars' else \
+            sum(len(line.split()) for line in text)
+        stats = throughput(
+            lambda: consume(corpus.generate_batches(
+                batch_size=batch_size, mode=mode, indexer=indexer)),
+            n_items)
+        emit("corpus.generate_batches", mode=mode, lines=lines,
+             context=context, batch_size=batch_size, **stats)
+        try:
+            import numpy           # noqa
+        except ImportError:
+            continue
+        corpus = Corpus((line for line in text), context=context)
+        stats = throughput(
+            lambda: consume_arrays(corpus.generate_arrays(
+                mode=mode, indexer=indexer)),
+            n_items)
+        emit("corpus.generate_arrays", mode=mode, lines=lines,
+             context=context, **stats)
+        for shuffle_buffer in (0, 10000):
+            corpus = Corpus((line for line in text), context=context)
+            stats = throughput(
+                lambda: consume(corpus.generate_array_batches(
+                    batch_size=batch_size, shuffle_buffer=shuffle_buffer,
+                    mode=mode, indexer=indexer)),
+                n_items)
+            emit("corpus.generate_array_batches", mode=mode, lines=lines,
+                 context=context, batch_size=batch_size,
+                 shuffle_buffer=shuffle_buffer, **stats)
+        fd, fname = tempfile.mkstemp(suffix='.txt')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.writelines(text)
+            n_jobs = jobs or os.cpu_count() or 1
+            shard_size = max(1, os.path.getsize(fname) // (4 * n_jobs))
+            for n in sorted({1, n_jobs}):
+                corpus = Corpus(fname, context=context)
+                stats = throughput(
+                    lambda: consume(corpus.generate_array_batches(
+                        batch_size=batch_size, mode=mode, indexer=indexer,
+                        n_jobs=n, shard_size=shard_size)),
+                    n_items)
+                emit("corpus.generate_array_batches.file", mode=mode,
+                     lines=lines, context=context, batch_size=batch_size,
+                     n_jobs=n, **stats)
+            corpus = Corpus(fname, context=context)
+            stats = throughput(
+                lambda: consume_steps(corpus.generate_array_batches(
+                    batch_size=batch_size, mode=mode, indexer=indexer),
+                    step_ms),
+                n_items)
+            emit("corpus.prefetch", mode=mode, lines=lines, context=context,
+                 batch_size=batch_size, step_ms=step_ms, prefetch=None,
+                 **stats)
+            for worker in ('thread', 'process'):
+                stats = throughput(
+                    lambda: consume_steps(corpus.prefetch(
+                        batch_size=batch_size, depth=8, worker=worker,
+                        mode=mode, indexer=indexer), step_ms),
+                    n_items)
+                emit("corpus.prefetch", mode=mode, lines=lines,
+                     context=context, batch_size=batch_size,
+                     step_ms=step_ms, prefetch=worker, **stats)
+            corpus = Corpus(fname, context=context)
+            cache_dir = fname + '.cache'
+            start = time.perf_counter()
+            corpus.build_cache(indexer, cache_dir, mode=mode)
+            build_s = time.perf_counter() - start
+            stats = throughput(
+                lambda: consume(corpus.generate_array_batches(
+                    batch_size=batch_size, mode=mode, indexer=indexer)),
+                n_items)
+            emit("corpus.generate_array_batches.cached", mode=mode,
+                 lines=lines, context=context, batch_size=batch_size,
+                 build_seconds=build_s, **stats)
+        finally:
+            os.remove(fname)
+            shutil.rmtree(fname + '.cache', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--context', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--jobs', type=int,
+                        help='Processes for parallel encoding (default: all)')
+    parser.add_argument('--step-ms', type=float, default=1.0,
+                        help='Simulated training time per batch')
+    args = parser.parse_args()
+    run(lines=args.lines, context=args.context, batch_size=args.batch_size,
+        jobs=args.jobs, step_ms=args.step_ms)
@@ -0,0 +1,47 @@
+# coding: utf-8
+
+"""
+Cost of a single db write under each durability mode of
+casket.storage.AtomicJSONStorage, compared to TinyDB's in-place JSONStorage.
+
+    $ python benchmarks/durability.py --sessions 10 1000 --repeat 50
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from tinydb.storages import JSONStorage
+
+from casket.storage import AtomicJSONStorage, FSYNC_MODES
+
+from common import measure, emit, make_experiment_doc
+
+
+def storages(path):
+    yield "inplace", JSONStorage(path)
+    for mode in FSYNC_MODES:
+        yield "atomic-" + mode, AtomicJSONStorage(path, fsync=mode)
+
+
+def run(sessions=(10, 1000), repeat=50):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for n_sessions in sessions:
+            data = make_experiment_doc(n_sessions)
+            for name, storage in storages(os.path.join(tmpdir, "db.json")):
+                stats = measure(lambda: storage.write(data), repeat=repeat)
+                storage.close()
+                emit("durability.write", storage=name, sessions=n_sessions,
+                     **stats)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(sessions=args.sessions, repeat=args.repeat)
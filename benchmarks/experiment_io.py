@@ -0,0 +1,110 @@
+# coding: utf-8
+
+"""
+Latency of Model.add_result and Model.add_epoch as a function of the
+number of sessions already stored in the db, both on a local file and on a
+stand-in for SFTPStorage (whole-file download on read and upload on write,
+paying simulated network costs, so that no remote host is needed).
+
+    $ python benchmarks/experiment_io.py --sessions 1 100 10000 --repeat 5
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from tinydb import TinyDB
+
+from casket.experiment import Experiment
+from casket.storage import AtomicJSONStorage
+
+from common import measure, emit, make_experiment_doc
+
+
+class SFTPStandInStorage(AtomicJSONStorage):
+    """
+    Mimics the I/O pattern of SFTPStorage on a local file: each read and
+    write transfers the whole file, paying a round trip plus transfer time.
+
+    Parameters:
+    -----------
+    latency: float, seconds per round trip
+    bandwidth: float, bytes per second
+    """
+    def __init__(self, path, latency=0.005, bandwidth=10e6, **kwargs):
+        super(SFTPStandInStorage, self).__init__(path, fsync='never', **kwargs)
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def _transfer(self):
+        time.sleep(self.latency + os.path.getsize(self.path) / self.bandwidth)
+
+    def read(self):
+        self._transfer()
+        return super(SFTPStandInStorage, self).read()
+
+    def write(self, data):
+        super(SFTPStandInStorage, self).write(data)
+        self._transfer()
+
+
+def open_experiment(path, storage):
+    exp = Experiment(path, exp_id="bench")
+    if storage == "sftp-standin":
+        exp.close()
+        exp.db = TinyDB(path, storage=SFTPStandInStorage)
+    return exp
+
+
+def close_experiment(exp, storage):
+    if storage == "sftp-standin":
+        exp.db.close()
+    else:
+        exp.close()
+
+
+def run(sessions=(1, 10, 100, 1000, 10000, 100000), repeat=5,
+        storages=("local", "sftp-standin")):
+    tmpdir = tempfile.mkdtemp()
+    counter = itertools.count()
+    try:
+        for n_sessions, storage in itertools.product(sessions, storages):
+            path = os.path.join(tmpdir, "db-%d.json" % n_sessions)
+            with open(path, "w") as f:
+                json.dump(make_experiment_doc(n_sessions), f)
+            size = os.path.getsize(path)
+            model = open_experiment(path, storage).model("model")
+
+            stats = measure(
+                lambda: model.add_result(
+                    {"acc": 1.0}, params={"run": next(counter)}),
+                repeat=repeat)
+            emit("experiment.add_result", storage=storage,
+                 sessions=n_sessions, db_bytes=size, **stats)
+
+            with model.session({"run": next(counter)}) as session:
+                epochs = itertools.count()
+                stats = measure(
+                    lambda: session.add_epoch(next(epochs), {"loss": 0.5}),
+                    repeat=repeat)
+            emit("experiment.add_epoch", storage=storage,
+                 sessions=n_sessions, db_bytes=size, **stats)
+            close_experiment(model.e, storage)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+',
+                        default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument('--storage', nargs='+',
+                        default=['local', 'sftp-standin'],
+                        choices=['local', 'sftp-standin'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(sessions=args.sessions, repeat=args.repeat, storages=args.storage)
@@ -0,0 +1,52 @@
+# coding: utf-8
+
+"""
+Import-time regression benchmark: measures `import casket` in fresh
+interpreters and checks that it doesn't pull in heavy dependencies.
+Exits with status 1 on regression.
+
+    $ python benchmarks/import_time.py --repeat 20 --max-ms 50
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from common import emit
+
+
+HEAVY = ('tinydb', 'keras', 'tensorflow', 'numpy', 'paramiko', 'requests')
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import casket
+elapsed = (time.perf_counter() - start) * 1000
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"ms": elapsed, "heavy": heavy}))
+""" % (HEAVY,)
+
+
+def import_once(statement=SCRIPT):
+    output = subprocess.check_output([sys.executable, '-c', statement])
+    return json.loads(output.decode('utf-8'))
+
+
+def run(repeat=20, max_ms=None):
+    samples = [import_once() for _ in range(repeat)]
+    times = sorted(s["ms"] for s in samples)
+    heavy = sorted(set(m for s in samples for m in s["heavy"]))
+    median = times[len(times) // 2]
+    emit("import.casket", repeat=repeat, median_ms=median, min_ms=times[0],
+         max_ms=times[-1], heavy_modules=heavy)
+    return not heavy and (max_ms is None or median <= max_ms)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if the median import time exceeds this')
+    args = parser.parse_args()
+    sys.exit(0 if run(repeat=args.repeat, max_ms=args.max_ms) else 1)
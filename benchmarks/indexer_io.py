@@ -0,0 +1,96 @@
+# coding: utf-8
+
+"""
+Indexer.encode_seq and encode_array throughput (and HashingIndexer's
+encode_seq), plus Indexer save/load time per vocabulary size and
+serialization mode. Binary indexers are memory-mapped on load, so their
+encode_seq throughput is also reported. Character vocabularies benchmark
+the lookup table path of encode_array. Vocabulary building
+(Indexer.fit_counts) is timed over a file of the encoded words.
+
+    $ python benchmarks/indexer_io.py --vocab 1000 100000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+
+from casket.nlp_utils import Corpus, HashingIndexer, Indexer
+
+from common import measure, throughput, emit
+
+
+MODES = ('json', 'pickle', 'binary')
+
+
+def run(vocab=(1000, 100000), seq_len=100000, repeat=5, modes=MODES,
+        jobs=2):
+    tmpdir = tempfile.mkdtemp()
+    rng = random.Random(1001)
+    try:
+        for vocab_size in vocab:
+            indexer = Indexer()
+            words = ['w%d' % i for i in range(vocab_size)]
+            indexer.fit(words)
+            seq = [rng.choice(words) for _ in range(seq_len)]
+            stats = throughput(lambda: indexer.encode_seq(seq), seq_len)
+            emit("indexer.encode_seq", vocab=vocab_size, **stats)
+            hashing = HashingIndexer()
+            stats = throughput(lambda: hashing.encode_seq(seq), seq_len)
+            emit("hashing_indexer.encode_seq", vocab=vocab_size, **stats)
+            indexer.encode_array(seq[:1])   # imports NumPy, builds tables
+            stats = throughput(lambda: indexer.encode_array(seq), seq_len)
+            emit("indexer.encode_array", vocab=vocab_size, **stats)
+            for mode in modes:
+                fname = os.path.join(tmpdir, 'indexer.' + mode)
+                stats = measure(
+                    lambda: indexer.save(fname, mode=mode), repeat=repeat)
+                emit("indexer.save", vocab=vocab_size, mode=mode,
+                     bytes=os.path.getsize(fname), **stats)
+                stats = measure(
+                    lambda: Indexer.load(fname, mode=mode), repeat=repeat)
+                emit("indexer.load", vocab=vocab_size, mode=mode, **stats)
+            if 'binary' in modes:
+                # lookups in the memory-mapped vocabulary
+                loaded = Indexer.load(
+                    os.path.join(tmpdir, 'indexer.binary'), mode='binary')
+                stats = throughput(lambda: loaded.encode_seq(seq), seq_len)
+                emit("indexer.encode_seq.binary", vocab=vocab_size, **stats)
+            fname = os.path.join(tmpdir, 'corpus.txt')
+            with open(fname, 'w') as f:
+                for start in range(0, seq_len, 20):
+                    f.write(' '.join(seq[start:start + 20]) + '\n')
+            for n_jobs in sorted(set([1, jobs])):
+                stats = throughput(lambda: Indexer().fit_counts(
+                    Corpus(fname), mode='words', min_count=2, n_jobs=n_jobs,
+                    shard_size=1 << 18), seq_len)
+                emit("indexer.fit_counts", vocab=vocab_size, n_jobs=n_jobs,
+                     **stats)
+        chars = Indexer()
+        chars.fit([chr(c) for c in range(32, 1000)])
+        text = ''.join(rng.choice(chars.decoder[2:]) for _ in range(seq_len))
+        stats = throughput(lambda: chars.encode_seq(text), seq_len)
+        emit("indexer.encode_seq.chars", **stats)
+        chars.encode_array(text[:1])
+        stats = throughput(lambda: chars.encode_array(text), seq_len)
+        emit("indexer.encode_array.chars", **stats)
+        codes = chars.encode_array(text)
+        stats = throughput(lambda: chars.decode_array(codes), seq_len)
+        emit("indexer.decode_array.chars", **stats)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab', type=int, nargs='+',
+                        default=[1000, 100000])
+    parser.add_argument('--seq-len', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='Processes for parallel vocabulary counting')
+    args = parser.parse_args()
+    run(vocab=args.vocab, seq_len=args.seq_len, repeat=args.repeat,
+        jobs=args.jobs)
@@ -0,0 +1,53 @@
+# coding: utf-8
+
+"""
+Runs the benchmark suite. Records are printed and, with --output, appended
+as JSON lines to a file, tagged with the current commit, so that results
+from different versions can be compared over time.
+
+    $ python benchmarks/run.py --output bench.jsonl
+    $ python benchmarks/run.py --quick --only traversal indexer_io
+"""
+
+import argparse
+import importlib
+import os
+import uuid
+
+import common
+
+
+SUITE = ('experiment_io', 'traversal', 'corpus_batches', 'indexer_io',
+         'durability', 'import_time')
+
+# smaller settings to check that nothing is broken in a few seconds
+QUICK = {
+    'experiment_io': dict(sessions=(1, 100, 1000), repeat=3),
+    'traversal': dict(sessions=(10, 1000), repeat=3),
+    'corpus_batches': dict(lines=200),
+    'indexer_io': dict(vocab=(1000,), seq_len=10000, repeat=3),
+    'durability': dict(sessions=(10,), repeat=10),
+    'import_time': dict(repeat=5),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='JSON lines file to append to')
+    parser.add_argument('--only', nargs='+', choices=SUITE, default=SUITE)
+    parser.add_argument('--quick', action='store_true')
+    args = parser.parse_args()
+
+    from casket.git import GitInfo
+    here = os.path.dirname(os.path.abspath(__file__))
+    common.RUN_INFO.update({"run": uuid.uuid4().hex,
+                            "commit": GitInfo(here).get_commit()})
+    if args.output:
+        common.OUTPUTS.append(open(args.output, 'a'))
+    for name in args.only:
+        module = importlib.import_module(name)
+        module.run(**(QUICK[name] if args.quick else {}))
+
+
+if __name__ == '__main__':
+    main()
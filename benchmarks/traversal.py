@@ -0,0 +1,58 @@
+# coding: utf-8
+
+"""
+Scaling of the in-memory document traversals behind every update:
+utils.update_in (appending an epoch to the first and to the last session of
+a model) and Model._check_params (a full scan for unseen params).
+
+    $ python benchmarks/traversal.py --sessions 10 1000 100000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from casket import utils
+from casket.experiment import Experiment, model_pred, params_pred
+
+from common import measure, emit, make_experiment_doc
+
+
+def run(sessions=(10, 100, 1000, 10000, 100000), repeat=10):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for n_sessions in sessions:
+            doc = make_experiment_doc(n_sessions)
+            exp = doc["_default"]["1"]
+            for which, idx in (("first", 0), ("last", n_sessions - 1)):
+                params = {"lr": idx, "seed": idx % 5}
+                path = ["models", model_pred("model"), "sessions",
+                        params_pred(params), "result", "epochs"]
+                stats = measure(
+                    lambda: utils.update_in(
+                        exp, path, lambda l: (l or []) + [{"loss": 0.1}]),
+                    repeat=repeat)
+                emit("utils.update_in", sessions=n_sessions, session=which,
+                     **stats)
+
+            db_path = os.path.join(tmpdir, "db-%d.json" % n_sessions)
+            with open(db_path, "w") as f:
+                json.dump(doc, f)
+            model = Experiment(db_path, exp_id="bench").model("model")
+            stats = measure(
+                lambda: model._check_params({"unseen": True}), repeat=repeat)
+            emit("model._check_params", sessions=n_sessions, **stats)
+            model.e.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(sessions=args.sessions, repeat=args.repeat)
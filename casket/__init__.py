@@ -1,12 +1,33 @@
 
 from __future__ import absolute_import
-from .experiment import Experiment
 
-try:
-    from .callback import DBCallback
-    raise ImportError
-except ImportError:
-    from warnings import warn
-    warn("Keras doesn't seem to be installed in your OS", ImportWarning)
+import importlib
 
-from . import nlp_utils
+# Submodules and their (possibly heavy) dependencies such as TinyDB or Keras
+# are only imported on first attribute access, so `import casket` stays cheap.
+_lazy_attrs = {
+    'Experiment': ('.experiment', 'Experiment'),
+    'DBCallback': ('.callback', 'DBCallback'),  # requires Keras
+}
+
+_submodules = {
+    'callback', 'cli', 'db', 'experiment', 'git', 'instrument', 'migrate',
+    'nlp_utils', 'server', 'sftp_storage', 'storage', 'telemetry', 'utils'
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attrs:
+        module, attr = _lazy_attrs[name]
+        value = getattr(importlib.import_module(module, __name__), attr)
+    elif name in _submodules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError(
+            "module '%s' has no attribute '%s'" % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs) | _submodules)
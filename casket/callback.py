@@ -26,7 +26,8 @@ class DBCallback(Callback):
         Can be use to skip over epochs.
 
     root: str, optional, default 'http://localhost:5000'
-        URL to publish results to. Set to None if local server isn't running
+        URL to publish results to (see `casket serve`).
+        Set to None if local server isn't running
     """
     def __init__(self, model, params, freq=1, root='http://localhost:5000'):
         self.model = model
@@ -81,7 +82,8 @@ class DBCallback(Callback):
 
     def on_train_begin(self, logs={}):
         self.model._start_session(self.params)
-        self.reach_server({'action': 'start', 'modelId': self.model_id},
+        self.reach_server({'action': 'start',
+                           'modelId': self.model.model_id},
                           '/publish/train/')
 
     def on_train_end(self, logs={}):
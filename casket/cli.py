@@ -0,0 +1,276 @@
+# coding: utf-8
+
+"""
+Command line interface:
+
+    $ casket serve db.json
+    $ casket migrate db.json db.sqlite --format sqlite
+    $ casket ls db.json
+    $ casket show db.json my-experiment --model lstm
+    $ casket top db.json --metric val_acc --k 10
+    $ casket tags db.json
+    $ casket export db.json --model lstm --format csv -o lstm.csv
+
+Query commands stream over the db one experiment at a time (see
+migrate.read), so memory use doesn't grow with the size of the db.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+
+def run_serve(args):
+    from .server import serve
+    logging.basicConfig(level=logging.INFO)
+    serve(args.path, host=args.host, port=args.port,
+          interval=args.interval, maxsize=args.queue_size)
+
+
+def run_migrate(args):
+    from . import migrate
+    if args.target is None:
+        fmt = migrate.detect_format(args.source)
+        print("format: %s\nschema: %d" % (
+            fmt, migrate.detect_schema(args.source, fmt)))
+        return
+    last = [0.0]
+
+    def progress(fraction):
+        now = time.time()
+        if now - last[0] >= 0.5 or fraction >= 1.0:
+            last[0] = now
+            sys.stderr.write("\r%5.1f%%" % (100 * fraction))
+            sys.stderr.flush()
+    try:
+        count = migrate.migrate(
+            args.source, args.target, fmt=args.format, schema=args.schema,
+            progress=None if args.quiet else progress)
+    except migrate.MigrationException as e:
+        sys.stderr.write("\nerror: %s\n" % e)
+        return 1
+    if not args.quiet:
+        sys.stderr.write("\nMigrated %d documents to [%s]\n" % (
+            count, args.target))
+
+
+def iter_experiments(path, exp_id=None):
+    from .migrate import read
+    for _, _, doc in read(path, exp_id=exp_id):
+        yield doc
+
+
+def iter_sessions(path, model_id=None):
+    """
+    Streams over (experiment, model, session) in the db at `path`
+    """
+    for exp in iter_experiments(path):
+        for model in exp.get("models", []):
+            if model_id is not None and model.get("modelId") != model_id:
+                continue
+            for session in model.get("sessions", []):
+                yield exp, model, session
+
+
+def run_ls(args):
+    for exp in iter_experiments(args.path):
+        tags = exp.get("tags") or []
+        if args.tag and args.tag not in tags:
+            continue
+        models = exp.get("models", [])
+        n_sessions = sum(len(m.get("sessions", [])) for m in models)
+        print("\t".join([str(exp.get("id")), str(exp.get("created", "")),
+                         "%d models" % len(models),
+                         "%d sessions" % n_sessions, ",".join(tags)]))
+
+
+def run_show(args):
+    for exp in iter_experiments(args.path, exp_id=args.exp_id):
+        doc = exp
+        if args.model is not None:
+            models = [m for m in exp.get("models", [])
+                      if m.get("modelId") == args.model]
+            if not models:
+                break
+            doc = models[0]
+        print(json.dumps(doc, indent=2, sort_keys=True))
+        return
+    sys.stderr.write("Couldn't find [%s]\n" % " ".join(
+        x for x in (args.exp_id, args.model) if x is not None))
+    return 1
+
+
+def session_score(session, metric, best):
+    """
+    Returns the final value of `metric` in a session result or, if missing,
+    its best value over epochs (None if neither exists)
+    """
+    from .migrate import get_epochs, get_final_results, is_number
+    result = session.get("result")
+    value = get_final_results(result).get(metric)
+    if value is None:
+        values = [epoch[metric] for epoch in get_epochs(result)
+                  if is_number(epoch.get(metric))]
+        value = best(values) if values else None
+    return value
+
+
+def run_top(args):
+    import heapq
+    best, sign = (min, -1) if args.min else (max, 1)
+    heap = []                   # (signed score, n, row): the k best so far
+    for n, (exp, model, session) in enumerate(
+            iter_sessions(args.path, args.model)):
+        score = session_score(session, args.metric, best)
+        if score is None:
+            continue
+        item = (sign * score, n, (score, exp.get("id"), model.get("modelId"),
+                                  session.get("params")))
+        if len(heap) < args.k:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+    for rank, (_, _, row) in enumerate(sorted(heap, reverse=True)):
+        score, exp_id, model_id, params = row
+        print("%d\t%g\t%s\t%s\t%s" % (
+            rank + 1, score, exp_id, model_id,
+            json.dumps(params, sort_keys=True)))
+
+
+def run_tags(args):
+    from collections import Counter
+    counts = Counter()
+    for exp in iter_experiments(args.path):
+        counts.update(exp.get("tags") or [])
+    for tag, count in counts.most_common():
+        print("%d\t%s" % (count, tag))
+
+
+def iter_rows(path, model_id=None, epochs=False):
+    """
+    Flattens sessions (or their epochs) into rows, with params prefixed
+    by "params."
+    """
+    from .migrate import get_epochs, get_final_results
+    for exp, model, session in iter_sessions(path, model_id):
+        row = {"experiment": exp.get("id"), "model": model.get("modelId"),
+               "timestamp": (session.get("meta") or {}).get("timestamp")}
+        row.update(("params." + k, v)
+                   for k, v in (session.get("params") or {}).items())
+        if epochs:
+            for epoch in get_epochs(session.get("result")):
+                epoch_row = dict(row)
+                epoch_row.update(epoch)
+                yield epoch_row
+        else:
+            row.update(get_final_results(session.get("result")))
+            yield row
+
+
+def run_export(args):
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        rows = iter_rows(args.path, args.model, args.epochs)
+        if args.format == 'jsonl':
+            for row in rows:
+                out.write(json.dumps(row, sort_keys=True) + '\n')
+        else:
+            import csv
+            # a first pass finds all columns, so rows needn't be kept
+            columns = ["experiment", "model", "timestamp"]
+            seen = set(columns)
+            for row in rows:
+                for key in sorted(row):
+                    if key not in seen:
+                        seen.add(key)
+                        columns.append(key)
+            writer = csv.DictWriter(out, columns, lineterminator='\n')
+            writer.writeheader()
+            for row in iter_rows(args.path, args.model, args.epochs):
+                writer.writerow(row)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='casket')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve = subparsers.add_parser(
+        'serve', help='Serve live results from a db file')
+    serve.add_argument('path')
+    serve.add_argument('--host', default='localhost')
+    serve.add_argument('--port', default=5000, type=int)
+    serve.add_argument('--interval', default=1.0, type=float,
+                       help='Seconds between polls of the db file')
+    serve.add_argument('--queue-size', default=256, type=int,
+                       help='Max pending events per subscriber')
+    serve.set_defaults(func=run_serve)
+
+    migrate = subparsers.add_parser(
+        'migrate', help='Convert a db to another schema version or format')
+    migrate.add_argument('source')
+    migrate.add_argument('target', nargs='?',
+                         help='Output path. If missing, show source info')
+    migrate.add_argument('--format', choices=('json', 'jsonl', 'sqlite'),
+                         help='Output format (default: same as source)')
+    migrate.add_argument('--schema', type=int,
+                         help='Output schema version (default: current)')
+    migrate.add_argument('--quiet', action='store_true')
+    migrate.set_defaults(func=run_migrate)
+
+    ls = subparsers.add_parser('ls', help='List experiments')
+    ls.add_argument('path')
+    ls.add_argument('--tag', help='Only list experiments with this tag')
+    ls.set_defaults(func=run_ls)
+
+    show = subparsers.add_parser(
+        'show', help='Print an experiment (or one of its models) as JSON')
+    show.add_argument('path')
+    show.add_argument('exp_id')
+    show.add_argument('--model')
+    show.set_defaults(func=run_show)
+
+    top = subparsers.add_parser(
+        'top', help='Show the best sessions by a result metric')
+    top.add_argument('path')
+    top.add_argument('--metric', required=True,
+                     help='Final result, or best epoch value if missing')
+    top.add_argument('--k', default=10, type=int)
+    top.add_argument('--model', help='Only sessions of this model')
+    top.add_argument('--min', action='store_true',
+                     help='Lower is better (e.g. loss)')
+    top.set_defaults(func=run_top)
+
+    tags = subparsers.add_parser('tags', help='Count experiment tags')
+    tags.add_argument('path')
+    tags.set_defaults(func=run_tags)
+
+    export = subparsers.add_parser(
+        'export', help='Export sessions as flat rows (params and results)')
+    export.add_argument('path')
+    export.add_argument('--model', help='Only sessions of this model')
+    export.add_argument('--epochs', action='store_true',
+                        help='One row per epoch instead of per session')
+    export.add_argument('--format', choices=('jsonl', 'csv'),
+                        default='jsonl')
+    export.add_argument('-o', '--output', help='Output file (default: stdout)')
+    export.set_defaults(func=run_export)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        return 1
+    try:
+        return args.func(args)
+    except BrokenPipeError:     # e.g. output piped into head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
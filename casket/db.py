@@ -1,27 +1,95 @@
 
-from tinydb import TinyDB
+import json
+import warnings
+from collections import OrderedDict
 from itertools import chain
 
+from tinydb import where
+
+from .storage import acquire, release
+from .migrate import get_epochs, get_final_results, is_number
+
+
+def _freeze(items):
+    return None if items is None else tuple(items)
+
+
+def _summarize(values, quantiles=()):
+    """
+    Computes stats over the rows of a 2d array (sessions x points), in which
+    missing values are NaN
+
+    Returns:
+    --------
+    dict {stat: 1d array}, stats being count, mean, std, min, max and a
+        `q<percent>` entry per quantile (e.g. q50 for the median)
+    """
+    import numpy as np
+    stats = {"count": (~np.isnan(values)).sum(axis=0)}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN columns
+        stats["mean"] = np.nanmean(values, axis=0)
+        stats["std"] = np.nanstd(values, axis=0)
+        stats["min"] = np.nanmin(values, axis=0)
+        stats["max"] = np.nanmax(values, axis=0)
+        for q in quantiles:
+            stats["q%g" % (q * 100)] = np.nanquantile(values, q, axis=0)
+    return stats
+
 
 class DB:
-    def __init__(self, path):
-        try:
-            from sftp_storage import SFTPStorage, WrongPathException
-            try:
-                self.db = TinyDB(path, policy='autoadd', storage=SFTPStorage)
-            except WrongPathException:
-                self.db = TinyDB(path)
-        except ImportError:
-            from warnings import warn
-            warn("""`paramiko` doesn't seem to be installed in your OS.
-            Remote db access is disabled""", ImportWarning)
-            self.db = TinyDB(path)
+    """
+    Read access to all experiments in a db.
+
+    Parameters:
+    -----------
+    path: str, local path or username@host:/path/to/remote/file
+    fsync: str, see storage.AtomicJSONStorage (only 'always' keeps the db
+        intact on power loss)
+    readonly: bool, never write to the db. Remote dbs are then queried on
+        a local snapshot, downloaded once and updated by `refresh`.
+    """
+    def __init__(self, path, fsync='always', readonly=False):
+        self.db = acquire(path, fsync=fsync, readonly=readonly)
+        self._cache, self._generation = {}, None
+
+    def close(self):
+        """
+        Releases the handle on the shared db (see storage.acquire)
+        """
+        if self.db is not None:
+            release(self.db)
+            self.db = None
+
+    def refresh(self):
+        """
+        Picks up changes to the db made since it was opened. Only needed
+        for read-only remote dbs, other dbs are always up to date.
+        """
+        self.db.storage.refresh()
+        self.db.clear_cache()
+
+    def _cached(self, key, f):
+        """
+        Returns f(), computed again only after the db has changed
+        (see AtomicJSONStorage.poll). Storages without a stable generation
+        (e.g. read-write SFTPStorage) compute f() on every call.
+        """
+        poll = getattr(self.db.storage, 'poll', None)
+        generation = poll() if poll is not None else None
+        if generation is None:
+            return f()
+        if generation != self._generation:
+            self._cache, self._generation = {}, generation
+        if key not in self._cache:
+            self._cache[key] = f()
+        return self._cache[key]
 
     def get_experiments(self):
-        return self.db.search()
+        return self.db.all()
 
     def get_experiment(self, experiment_id):
-        return self.db.get({"id": experiment_id})
+        return self.db.get(where("id") == experiment_id)
 
     def get_model(self, experiment_id, model_id):
         models = self.get_experiment(experiment_id)["models"]
@@ -29,8 +97,147 @@ class DB:
             if m["modelId"] == model_id:
                 return m
 
+    def get_sessions(self, model_id, experiment_id=None):
+        """
+        Returns the sessions of a model across all experiments (or only
+        experiment `experiment_id` if given)
+        """
+        sessions = []
+        for exp in self.get_experiments():
+            if experiment_id is not None and exp.get("id") != experiment_id:
+                continue
+            for model in exp.get("models", []):
+                if model.get("modelId") == model_id:
+                    sessions.extend(model.get("sessions", []))
+        return sessions
+
+    def group_sessions(self, model_id, by=None, ignore=('seed',),
+                       experiment_id=None):
+        """
+        Groups the sessions of a model by the values of some of their params
+
+        Parameters:
+        -----------
+        model_id: str
+        by: list of param names, optional. Defaults to all params of each
+            session except those in `ignore`.
+        ignore: list of param names, params varying within a group
+        experiment_id: str, optional, see get_sessions
+
+        Returns:
+        --------
+        list of (params, sessions), where params is a dict with the values
+            shared by the group, in order of first appearance
+        """
+        groups = OrderedDict()
+        for session in self.get_sessions(model_id, experiment_id):
+            params = session.get("params") or {}
+            keys = by if by is not None else \
+                sorted(k for k in params if k not in ignore)
+            group = {k: params.get(k) for k in keys}
+            key = json.dumps(group, sort_keys=True)  # values may be lists
+            groups.setdefault(key, (group, []))[1].append(session)
+        return list(groups.values())
+
+    def aggregate_epochs(self, model_id, by=None, metrics=None,
+                         quantiles=(), ignore=('seed',), experiment_id=None):
+        """
+        Aggregates epoch results across the sessions of each group (e.g. runs
+        of the same config with different seeds), aligning epochs by
+        `epoch_num`. Sessions without a given epoch (or metric) are left out
+        of its stats. Requires NumPy.
+
+        Results are cached until the db changes and shared between calls,
+        so they shouldn't be modified.
+
+        Example:
+        for group in DB("db.json").aggregate_epochs("lstm", metrics=["loss"]):
+            print(group["params"], group["loss"]["mean"][-1])
+
+        Parameters:
+        -----------
+        model_id: str
+        by, ignore, experiment_id: see group_sessions
+        metrics: list of epoch keys, optional. Defaults to all keys with
+            numeric values.
+        quantiles: list of floats in [0, 1], e.g. (0.25, 0.5, 0.75)
+
+        Returns:
+        --------
+        list of dicts, one per group, with keys:
+            params: dict, see group_sessions
+            n_sessions: int
+            epoch_num: 1d array, sorted epoch numbers
+            <metric>: dict {stat: 1d array aligned with epoch_num},
+                see _summarize
+        """
+        key = ('epochs', model_id, _freeze(by), _freeze(metrics),
+               tuple(quantiles), tuple(ignore), experiment_id)
+        return self._cached(key, lambda: [
+            self._aggregate_epochs(params, sessions, metrics, quantiles)
+            for params, sessions in self.group_sessions(
+                model_id, by=by, ignore=ignore, experiment_id=experiment_id)])
+
+    @staticmethod
+    def _aggregate_epochs(params, sessions, metrics, quantiles):
+        import numpy as np
+        rows, nums, records = [], [], []
+        for row, session in enumerate(sessions):
+            for epoch in get_epochs(session.get("result")):
+                if "epoch_num" in epoch:
+                    rows.append(row)
+                    nums.append(epoch["epoch_num"])
+                    records.append(epoch)
+        if metrics is None:
+            metrics = sorted(set(
+                k for epoch in records for k, v in epoch.items()
+                if k != "epoch_num" and is_number(v)))
+        epoch_num, cols = np.unique(np.array(nums), return_inverse=True)
+        group = {"params": params, "n_sessions": len(sessions),
+                 "epoch_num": epoch_num}
+        for metric in metrics:
+            values = np.full((len(sessions), len(epoch_num)), np.nan)
+            column = [epoch.get(metric) for epoch in records]
+            values[rows, cols] = [v if is_number(v) else np.nan
+                                  for v in column]
+            group[metric] = _summarize(values, quantiles)
+        return group
+
+    def aggregate_results(self, model_id, by=None, metrics=None,
+                          quantiles=(), ignore=('seed',), experiment_id=None):
+        """
+        Like aggregate_epochs, but aggregates final session results
+        (see migrate.get_final_results).
+
+        Returns:
+        --------
+        list of dicts, one per group, with keys params, n_sessions and
+            <metric>: dict {stat: number}
+        """
+        key = ('results', model_id, _freeze(by), _freeze(metrics),
+               tuple(quantiles), tuple(ignore), experiment_id)
+        return self._cached(key, lambda: [
+            self._aggregate_results(params, sessions, metrics, quantiles)
+            for params, sessions in self.group_sessions(
+                model_id, by=by, ignore=ignore, experiment_id=experiment_id)])
+
+    @staticmethod
+    def _aggregate_results(params, sessions, metrics, quantiles):
+        import numpy as np
+        records = [get_final_results(session.get("result"))
+                   for session in sessions]
+        if metrics is None:
+            metrics = sorted(set(k for record in records for k in record))
+        group = {"params": params, "n_sessions": len(sessions)}
+        for metric in metrics:
+            values = np.array([[record.get(metric, np.nan)]
+                               for record in records], dtype=float)
+            group[metric] = {stat: column[0] for stat, column
+                             in _summarize(values, quantiles).items()}
+        return group
+
     def get_tags(self):
-        return chain(*[exp['tags'] for exp in self.db.search()])
+        return chain(*[exp['tags'] for exp in self.db.all()])
 
     def get_timestamps(self):
         return [model["meta"]["timestamp"]
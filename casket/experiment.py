@@ -1,16 +1,20 @@
 # coding: utf-8
 
 import contextlib
+import functools
+import json
 import logging
 from datetime import datetime
 from uuid import uuid4
 from platform import platform
 from getpass import getuser
 
-from tinydb import TinyDB, where
+from tinydb import where
 
 from . import utils
 from .git import GitInfo
+from .storage import acquire, release, AtomicJSONStorage, UNINDEXED_KEY
+from .telemetry import Telemetry
 
 
 logger = logging.getLogger(__name__)
@@ -50,6 +54,16 @@ def append_in(path, item):
     return transform
 
 
+def concat_in(path, items):
+    """
+    Appends all `items` to a list nested in the matching db entry specified
+    by `path`
+    """
+    def transform(element):
+        utils.update_in(element, path, lambda l: (l or []) + items)
+    return transform
+
+
 def assign_in(path, item):
     """
     Sets item to a dict nested in the matching db entry specified by `path`
@@ -137,50 +151,117 @@ class Experiment:
     path : str
         Path to the database file backend. A path in a remote machine can
         be specified with syntax: username@host:/path/to/remote/file.
+    fsync : str, optional, default 'always'
+        Durability mode for local files, one of 'always', 'interval' or
+        'never' (see storage.AtomicJSONStorage). Writes are atomic with
+        respect to process crashes in all modes, but only 'always' keeps
+        the db intact on power loss.
+    profile : bool, optional, default False
+        Record I/O, (de)serialization, update and git timings, see
+        Experiment.stats. Can also be toggled with Experiment.instrument.
+
+    All Experiment (and DB) instances on the same path within a process
+    share a single db, storage and in-memory cache (see storage.acquire),
+    and therefore also their instrumentation. Experiment.close releases
+    the instance's handle; the db is closed once all handles are released.
     """
-    def __init__(self, path, exp_id=None, verbose=False):
+    def __init__(self, path, exp_id=None, verbose=False, fsync='always',
+                 profile=False):
         assert path, "Path cannot be the empty string"
         self.level = logging.WARN if verbose else logging.NOTSET
-        try:
-            from sftp_storage import SFTPStorage, WrongPathException
-            try:
-                self.db = TinyDB(path, policy='autoadd', storage=SFTPStorage)
-                log("Using remote db file [%s]" % path, level=self.level)
-            except WrongPathException:
-                self.db = TinyDB(path)
-        except:
-            self.db = TinyDB(path)
+        self.db = acquire(path, fsync=fsync)
+        self.instrument = self.db.storage.instrument
+        if profile:
+            self.instrument.enable()
+        if isinstance(self.db.storage, AtomicJSONStorage):
             log("Using local file [%s]" % path, level=self.level)
+        else:
+            log("Using remote db file [%s]" % path, level=self.level)
 
-        self.git = GitInfo(self.getsourcefile())
+        self.git = GitInfo(self.getsourcefile(), instrument=self.instrument)
         self.id = exp_id if exp_id else self.get_id()
+        self.cond = where("id") == self.id
+        self._model_conds = {}
+        # storage generation, serialized experiment doc
+        self._cached = (None, None)
 
     def get_id(self):
         return uuid4().hex
 
+    def close(self):
+        """
+        Releases the experiment's handle on the shared db (see __init__)
+        """
+        if self.db is not None:
+            release(self.db)
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def stats(self):
+        """
+        Returns counters and timings recorded while profiling is enabled
+        (see instrument.Instrument.stats)
+        """
+        return self.instrument.stats()
+
+    def _update(self, transform, cond):
+        with self.instrument.timer('update'):
+            return self.db.update(
+                self.instrument.wrap('transform', transform), cond)
+
     def getsourcefile(self):
         return utils.getsourcefile(lambda: None)
 
+    def _get(self):
+        """
+        Returns the experiment document, which is only looked up again
+        after the db has changed (see AtomicJSONStorage.poll). Storages
+        without a stable generation (e.g. read-write SFTPStorage) are read
+        once per call. The document returned is a new copy on every call.
+        """
+        poll = getattr(self.db.storage, 'poll', None)
+        generation = poll() if poll is not None else None
+        if generation is None:
+            return self.db.get(self.cond)
+        if self._cached[0] != generation:
+            doc = self.db.get(self.cond)
+            self._cached = (generation, None if doc is None else
+                            json.dumps(doc))
+        return None if self._cached[1] is None else \
+            json.loads(self._cached[1])
+
+    def _model_cond(self, model_id):
+        if model_id not in self._model_conds:
+            self._model_conds[model_id] = \
+                self.cond & where("models").any(where("modelId") == model_id)
+        return self._model_conds[model_id]
+
     def exists(self):
-        return self.db.get(where("id") == self.id)
+        return self._get()
 
     def add_tag(self, tag):
-        self.db.update(extend("tags", tag), where("id") == self.id)
+        self._update(extend("tags", tag), self.cond)
 
     def remove_tag(self, tag):
-        return self.db.update(remove("tags", tag), where("id") == self.id)
+        return self._update(remove("tags", tag), self.cond)
 
     def get_models(self):
-        experiment = self.db.get(where("id") == self.id)
+        experiment = self._get()
         return experiment.get("models") if experiment else {}
 
     @classmethod
-    def new(cls, path, exp_id=None, tags=(), **params):
+    def new(cls, path, exp_id=None, tags=(), fsync='always', profile=False,
+            **params):
         """
         Stores a new Experiment in the database. Throws an exception if
         experiment already exists.
         """
-        exp = cls(path, exp_id=exp_id)
+        exp = cls(path, exp_id=exp_id, fsync=fsync, profile=profile)
         if exp.exists():
             raise ValueError("Experiment %s already exists" % str(exp.id))
         now, exp_id = str(datetime.now()), exp_id or exp.id
@@ -189,17 +270,20 @@ class Experiment:
         return exp
 
     @classmethod
-    def use(cls, path, exp_id=None, tags=(), **params):
+    def use(cls, path, exp_id=None, tags=(), fsync='always', profile=False,
+            **params):
         """
         Stores a new Experiment if none can be found with given parameters,
         otherwise instantiate the existing one with data from database.
         """
-        exp = cls(path, exp_id=exp_id)
+        exp = cls(path, exp_id=exp_id, fsync=fsync, profile=profile)
         if exp.exists():
             return exp
         else:
             log("Creating new Experiment %s" % str(exp.id))
-            return cls.new(path, exp_id=exp_id, tags=tags, **params)
+            exp.close()
+            return cls.new(path, exp_id=exp_id, tags=tags, fsync=fsync,
+                           profile=profile, **params)
 
     def model_exists(self, model_id):
         """
@@ -207,27 +291,98 @@ class Experiment:
         --------
         dict or None
         """
-        return self.db.get(
-            (where("id") == self.id) &
-            where("models").any(where("modelId") == model_id))
+        experiment = self._get()
+        if experiment is None:
+            return None
+        for model in experiment.get("models", []):
+            if model["modelId"] == model_id:
+                return experiment
 
     def model(self, model_id, model_config={}):
         return self.Model(self, model_id, {"config": model_config})
 
+    def run_grid(self, model_id, fn, param_grid, n_jobs=1, model_config={}):
+        """
+        Runs `fn(**params)` for every combination in `param_grid` and stores
+        each returned result as a new session of model `model_id` (see
+        Model.add_result). Combinations that the model has already been run
+        with are skipped (same semantics as Model._check_params), so running
+        the same grid again after a crash resumes where it stopped.
+
+        Workers only compute results; all of them are written to the
+        database by the calling process as soon as they are available.
+        If a worker raises, points that haven't started are cancelled, the
+        results of those already running are still written, and the first
+        exception is then re-raised.
+
+        Example:
+        def fit_svm(C, kernel):
+            ...
+            return {"accuracy": accuracy}
+
+        Experiment.use("test.json", exp_id="svm").run_grid(
+            "SVC", fit_svm, {"C": [1, 10, 100], "kernel": ["rbf"]}, n_jobs=4)
+
+        Parameters:
+        -----------
+        model_id: str
+        fn: function taking params as keyword arguments and returning a
+            serializable result. It must be picklable (e.g. defined at
+            module level) if n_jobs != 1.
+        param_grid: dict or list of dicts, see utils.param_grid
+        n_jobs: int, number of worker processes. -1 uses one per cpu and
+            1 runs everything in the current process.
+        model_config: dict, see Experiment.model
+
+        Returns:
+        --------
+        list of params that were run
+        """
+        model = self.model(model_id, model_config)
+        done = [session["params"] for session in model.get_sessions()]
+        todo = [p for p in utils.param_grid(param_grid) if p not in done]
+        if n_jobs == 1:
+            for params in todo:
+                model.add_result(fn(**params), params=params)
+            return todo
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        max_workers = None if n_jobs < 0 else n_jobs
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(fn, **params): params for params in todo}
+            error = None
+            try:
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                            for pending in futures:
+                                pending.cancel()
+                        continue
+                    model.add_result(future.result(), params=futures[future])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        if error is not None:
+            raise error
+        return todo
+
     class Model:
         def __init__(self, experiment, model_id, model_config):
             self._session_params = None
+            self._memo, self._commit = (None, None), None
             self.e = experiment
             self.model_id = model_id
             self.which_model = model_pred(self.model_id)
-            self.cond = ((where("id") == experiment.id) &
-                         where("models").any(where("modelId") == model_id))
+            self.cond = experiment._model_cond(model_id)
             if not self.exists():
                 self._add_default_model(**model_config)
 
         def _add_default_model(self, **kwargs):
             model = utils.merge({"modelId": self.model_id}, kwargs)
-            self.e.db.update(append("models", model), where("id") == self.e.id)
+            self.e._update(append("models", model), self.e.cond)
 
         def _result_meta(self):
             return {"commit": self.e.git.get_commit() or "not-git-tracked",
@@ -237,11 +392,7 @@ class Experiment:
                     "timestamp": str(datetime.now())}
 
         def _check_params(self, params):
-            models = self.e.get_models()
-            if not models:
-                return
-            model = next(m for m in models if m["modelId"] == self.model_id)
-            for result in model.get("sessions", []):
+            for result in self.get_sessions():
                 if result["params"] == params:
                     raise ExistingModelParamsException()
 
@@ -250,9 +401,10 @@ class Experiment:
             Add session result (new)
             """
             meta = self._result_meta()
-            result = {"params": params, "meta": meta, "result": result}
+            session = {"params": params, "meta": meta, "result": result}
             path = ["models", self.which_model, "sessions"]
-            self.e.db.update(append_in(path, result), self.cond)
+            self.e._update(append_in(path, session), self.cond)
+            return session
 
         def _add_session_result(self, result, index_by=None):
             """
@@ -269,18 +421,19 @@ class Experiment:
             index_by : serializable, optional
                 Key to store result by.
                 `result` is appended to session.result.index_by if given,
-                or to session.result otherwise.
+                or to session.result[UNINDEXED_KEY] otherwise, so that
+                the result stays a dict of lists (e.g. along epochs).
             """
             which_session = params_pred(self._session_params)
             path = ["models", self.which_model, "sessions", which_session,
-                    "result"] + ([index_by] or [])
-            self.e.db.update(append_in(path, result), self.cond)
+                    "result", UNINDEXED_KEY if index_by is None else index_by]
+            self.e._update(append_in(path, result), self.cond)
 
         def _start_session(self, params):
             self._session_params = params
             path = ["models", self.which_model, "sessions"]
             result = {"params": params, "meta": self._result_meta()}
-            self.e.db.update(append_in(path, result), self.cond)
+            self.e._update(append_in(path, result), self.cond)
 
         def _end_session(self):
             self._session_params = None
@@ -288,8 +441,19 @@ class Experiment:
         def exists(self):
             return self.e.model_exists(self.model_id)
 
+        def get_sessions(self):
+            """
+            Returns:
+            --------
+            list of stored sessions for the model
+            """
+            for model in self.e.get_models() or []:
+                if model["modelId"] == self.model_id:
+                    return model.get("sessions", [])
+            return []
+
         @contextlib.contextmanager
-        def session(self, params, ensure_unique=True):  # TODO: store on exit
+        def session(self, params, ensure_unique=True, telemetry=False):
             """
             Context manager for cases in which we want to add several results
             to the same experiment run. Current session is identified based on
@@ -306,19 +470,37 @@ class Experiment:
                 y_pred = svm.predict(X_test)
                 session.add_result({"accuracy": accuracy(y_pred, y_true)})
 
+            With `telemetry=True` wall time, CPU time, peak memory and
+            periodic samples are collected and stored on exit under the
+            session meta key "telemetry" (see telemetry.Telemetry):
+
+            with model_db.session(params, telemetry=True) as session:
+                svm.fit(X_train, y_train)
+
             Parameters:
             -----------
             params: dict, parameters passed in to the model instance
             ensure_unique: bool, throw an exception in case model has already
                 been run with the same parameters
+            telemetry: bool or telemetry.Telemetry, collect resource usage.
+                Pass a Telemetry instance to configure sampling.
             """
             assert isinstance(params, dict), \
                 "Params expected dict but got %s" % str(type(params))
             if ensure_unique:
                 self._check_params(params)
             self._start_session(params)
-            yield self
-            self._end_session()
+            monitor = None
+            if telemetry:
+                monitor = telemetry if isinstance(telemetry, Telemetry) \
+                    else Telemetry()
+                monitor.start()
+            try:
+                yield self
+            finally:
+                if monitor is not None:
+                    self.add_meta({"telemetry": monitor.stop()})
+                self._end_session()
 
         def add_meta(self, d):
             """
@@ -337,7 +519,7 @@ class Experiment:
             which_session = params_pred(self._session_params)
             path = ["models", self.which_model, "sessions", which_session,
                     "meta"]
-            self.e.db.update(assign_in(path, d), self.cond)
+            self.e._update(assign_in(path, d), self.cond)
 
         def add_result(self, result, params=None, index_by=None):
             """
@@ -350,6 +532,126 @@ class Experiment:
             else:
                 self._add_session_result(result, index_by=index_by)
 
+        def _generation(self):
+            poll = getattr(self.e.db.storage, 'poll', None)
+            return poll() if poll is not None else None
+
+        def _memo_index(self):
+            """
+            Returns an index from params hash to the last stored session
+            with a result, plus the current commit. The index is rebuilt
+            whenever the db has changed (see AtomicJSONStorage.poll), e.g.
+            after sessions were added by add_result or by another process,
+            and on every call for storages without a stable generation.
+            """
+            generation = self._generation()
+            if generation is None or self._memo[0] != generation:
+                index = {}
+                for session in self.get_sessions():
+                    if "result" in session:
+                        index[utils.params_hash(session["params"])] = session
+                self._memo = generation, index
+            if self._commit is None:
+                self._commit = self.e.git.get_commit() or "not-git-tracked"
+            return self._memo[1], self._commit
+
+        def cached_call(self, fn, params, check_commit=False):
+            """
+            Returns the result stored for `params` by a previous run if there
+            is one, otherwise computes `fn(**params)` and stores it as a new
+            session (see add_result). Stored sessions are looked up by a
+            canonical hash of their params (see utils.params_hash), indexed
+            until the db changes (see _memo_index).
+
+            Parameters:
+            -----------
+            fn: function taking params as keyword arguments and returning a
+                serializable result
+            params: dict
+            check_commit: bool, recompute if the stored result was produced
+                on a different git commit than the current one
+            """
+            index, commit = self._memo_index()
+            key = utils.params_hash(params)
+            session = index.get(key)
+            if session is not None:
+                if not check_commit or session["meta"].get("commit") == commit:
+                    return session["result"]
+            generation = self._generation()
+            index[key] = self._add_result(fn(**params), params)
+            if generation is not None and \
+                    self._generation() == generation + 1:
+                # only this session was written: the index is up to date
+                self._memo = generation + 1, index
+            return index[key]["result"]
+
+        def memoize(self, fn=None, check_commit=False):
+            """
+            Decorator version of cached_call. The decorated function must be
+            called with keyword arguments only, which are used as params.
+
+            Example:
+            model_db = Experiment.use("test.json").model("SVC")
+
+            @model_db.memoize
+            def evaluate(C=1.0, kernel="rbf"):
+                ...
+                return {"accuracy": accuracy}
+
+            for C in [1, 10, 100]:
+                evaluate(C=C, kernel="linear")  # only computed once per C
+
+            Parameters:
+            -----------
+            check_commit: bool, see cached_call
+            """
+            if fn is None:
+                return functools.partial(
+                    self.memoize, check_commit=check_commit)
+
+            @functools.wraps(fn)
+            def wrapper(**params):
+                return self.cached_call(fn, params, check_commit=check_commit)
+            return wrapper
+
+        def add_results(self, results, index_by=None):
+            """
+            Adds many results with a single db update, instead of one update
+            per result as with add_result.
+
+            Inside a session, `results` is an iterable of results appended to
+            the current session (see _add_session_result).
+            Outside a session, `results` is an iterable of (params, result)
+            pairs, each stored as a new session (see add_result).
+
+            Example:
+            from casket.utils import from_cv_results
+            with model_db.session({"grid_params": grid_params}) as session:
+                clf = GridSearchCV(SVC(), grid_params).fit(X_train, y_train)
+                session.add_results(from_cv_results(clf.cv_results_),
+                                    index_by="grid_search")
+
+            Parameters:
+            -----------
+            results: iterable of (serializable-)dicts or of (params, result)
+            index_by : serializable, optional, see _add_session_result
+            """
+            results = list(results)
+            if not results:
+                return
+            if self._session_params:
+                which_session = params_pred(self._session_params)
+                path = ["models", self.which_model, "sessions", which_session,
+                        "result",
+                        UNINDEXED_KEY if index_by is None else index_by]
+                self.e._update(concat_in(path, results), self.cond)
+            else:
+                meta = self._result_meta()
+                sessions = [{"params": params, "meta": meta, "result": result}
+                            for params, result in results]
+                path = ["models", self.which_model, "sessions"]
+                self.e._update(concat_in(path, sessions), self.cond)
+
         def add_epoch(self, epoch_num, result, timestamp=True):
             if not self._session_params:
                 raise ValueError("add_epoch requires session context manager")
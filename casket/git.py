@@ -3,6 +3,7 @@ import logging
 from subprocess import check_output, CalledProcessError
 
 from . import utils
+from .instrument import Instrument
 
 
 logger = logging.getLogger(__name__)
@@ -16,12 +17,13 @@ class GitInfo:
     """
     Utility class to retrieve git-based info from a repository
     """
-    def __init__(self, fname):
+    def __init__(self, fname, instrument=None):
         self.dirname = utils.get_dir(fname)
+        self.instrument = instrument or Instrument()
 
     def run(self, cmd):
         try:
-            with utils.silence():
+            with utils.silence(), self.instrument.timer('git'):
                 output = check_output(cmd, cwd=self.dirname)
                 return output.strip().decode('utf-8')
         except OSError:
@@ -0,0 +1,134 @@
+# coding: utf-8
+
+from time import perf_counter
+
+
+class _Timer(object):
+    __slots__ = ('instrument', 'op', 'start')
+
+    def __init__(self, instrument, op):
+        self.instrument = instrument
+        self.op = op
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrument.record(self.op, perf_counter() - self.start)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Instrument(object):
+    """
+    Per-operation counters and timers for db I/O. While disabled, timers
+    are a shared no-op and counters return right away, so instrumented code
+    only pays for a flag check.
+
+    Operations recorded by casket:
+        read, write: storage I/O (time and bytes)
+        deserialize, serialize: JSON (de)serialization
+        cache_hit: storage read served from memory (file unchanged)
+        update: whole db update (read, transform and write)
+        transform: in-memory document update (e.g. utils.update_in)
+        git: git subprocesses (see GitInfo)
+
+    Hooks are called after each recorded operation as
+    `hook(op, seconds, nbytes)`, where nbytes is None for timed operations
+    and seconds is None for transferred bytes and counted operations.
+
+    Example:
+    exp = Experiment.use("test.json", exp_id="id")
+    exp.instrument.enable()
+    exp.instrument.add_hook(lambda op, secs, nbytes: print(op, secs))
+    ...
+    exp.stats()  # {"read": {"count": 3, "seconds": 0.001, "bytes": 120}, ..}
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.hooks = []
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.counts, self.seconds, self.bytes = {}, {}, {}
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, op, seconds):
+        self.counts[op] = self.counts.get(op, 0) + 1
+        self.seconds[op] = self.seconds.get(op, 0.0) + seconds
+        for hook in self.hooks:
+            hook(op, seconds, None)
+
+    def count(self, op):
+        """
+        Counts an untimed operation (e.g. a cache hit)
+        """
+        if not self.enabled:
+            return
+        self.counts[op] = self.counts.get(op, 0) + 1
+        for hook in self.hooks:
+            hook(op, None, None)
+
+    def add_bytes(self, op, nbytes):
+        if not self.enabled:
+            return
+        self.bytes[op] = self.bytes.get(op, 0) + nbytes
+        for hook in self.hooks:
+            hook(op, None, nbytes)
+
+    def timer(self, op):
+        """
+        Returns a context manager timing operation `op`
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, op)
+
+    def wrap(self, op, f):
+        """
+        Returns function `f` timed as operation `op` (or `f` if disabled)
+        """
+        if not self.enabled:
+            return f
+
+        def wrapped(*args, **kwargs):
+            with _Timer(self, op):
+                return f(*args, **kwargs)
+        return wrapped
+
+    def stats(self):
+        """
+        Returns:
+        --------
+        dict {op: {"count": int, "seconds": float[, "bytes": int]}}
+        """
+        stats = {}
+        for op in set(self.counts) | set(self.bytes):
+            stats[op] = {"count": self.counts.get(op, 0),
+                         "seconds": self.seconds.get(op, 0.0)}
+            if op in self.bytes:
+                stats[op]["bytes"] = self.bytes[op]
+        return stats
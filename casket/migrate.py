@@ -0,0 +1,434 @@
+# coding: utf-8
+
+"""
+Conversion of dbs between schema versions and on-disk formats.
+
+Schema versions (see storage.SCHEMA_VERSION):
+    1: nested layout, session results as lists of dicts (e.g. epochs)
+    2: as 1, with epochs packed into columns (see utils.pack_records),
+       a compact layout for archival and analysis. It can be read by
+       read-only dbs (casket.db.DB(path, readonly=True)), but Experiment
+       only opens version 1.
+
+Formats:
+    json: TinyDB JSON file, as used by Experiment
+    jsonl: journal with a header line and one line per document
+    sqlite: SQLite file with one row per document, indexed by experiment id
+
+Migrations stream over documents (experiments), so memory is bounded by
+the largest experiment rather than by the size of the db.
+
+    $ casket migrate db.json db.sqlite --format sqlite
+    $ casket migrate db.json packed.json --schema 2
+"""
+
+import json
+import os
+import sqlite3
+
+from . import utils
+from .storage import SCHEMA_VERSION, SCHEMA_TABLE, UNINDEXED_KEY, replace
+
+
+FORMATS = ('json', 'jsonl', 'sqlite')
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+
+class MigrationException(Exception):
+    pass
+
+
+"""
+Document migrations
+"""
+
+MIGRATIONS = {}                 # (from version, to version) -> function
+
+
+def migration(source, target):
+    """
+    Registers a function migrating an experiment document (in place)
+    from schema version `source` to `target`
+    """
+    def register(f):
+        MIGRATIONS[(source, target)] = f
+        return f
+    return register
+
+
+def iter_session_results(doc):
+    for model in doc.get("models", []):
+        for session in model.get("sessions", []):
+            if isinstance(session.get("result"), dict):
+                yield session["result"]
+
+
+@migration(1, 2)
+def pack_epochs(doc):
+    for result in iter_session_results(doc):
+        if isinstance(result.get("epochs"), list):
+            result["epochs"] = utils.pack_records(result["epochs"])
+
+
+@migration(2, 1)
+def unpack_epochs(doc):
+    for result in iter_session_results(doc):
+        if isinstance(result.get("epochs"), dict):
+            result["epochs"] = utils.unpack_records(result["epochs"])
+
+
+def get_epochs(result):
+    """
+    Returns the epochs of a session result as a list of dicts, whatever
+    the schema version of the db
+    """
+    epochs = result.get("epochs", []) if isinstance(result, dict) else []
+    if isinstance(epochs, dict):
+        return utils.unpack_records(epochs)
+    return epochs
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def get_final_results(result):
+    """
+    Returns the final numeric results of a session: the numeric values of
+    its result, plus those of the last record of any list of results other
+    than epochs (see Model.add_result), including results added without
+    `index_by` (under UNINDEXED_KEY)
+
+    >>> get_final_results({"acc": 0.9, "test": [{"f1": 0.5}, {"f1": 0.7}]})
+    {'acc': 0.9, 'f1': 0.7}
+    >>> get_final_results({"null": [{"acc": 0.8}], "epochs": [{"acc": 0.1}]})
+    {'acc': 0.8}
+    """
+    if isinstance(result, list):    # unindexed results stored as the result
+        result = {UNINDEXED_KEY: result}
+    final = {}
+    for key, value in (result or {}).items():
+        if is_number(value):
+            final[key] = value
+        elif key != "epochs" and isinstance(value, list) and value \
+                and isinstance(value[-1], dict):
+            final.update((k, v) for k, v in value[-1].items()
+                         if is_number(v))
+    return final
+
+
+def plan(source, target):
+    """
+    Returns the list of migrations from schema version `source` to `target`
+    """
+    step = 1 if target >= source else -1
+    steps = []
+    for version in range(source, target, step):
+        key = (version, version + step)
+        if key not in MIGRATIONS:
+            raise MigrationException(
+                "No migration from schema %d to %d" % key)
+        steps.append(MIGRATIONS[key])
+    return steps
+
+
+"""
+Streaming readers: generators over (table, doc_id, doc)
+"""
+
+
+class _JSONStreamReader(object):
+    """
+    Incrementally parses a TinyDB JSON file, {table: {doc_id: doc}}, holding
+    at most one document (plus a read chunk) in memory
+    """
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf, self.pos, self.eof = '', 0, False
+        self.consumed = 0       # characters read from file
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+        more = self.f.read(max(size or 0, self.chunk_size))
+        self.consumed += len(more)
+        self.eof = not more
+        self.buf, self.pos = self.buf[self.pos:] + more, 0
+        return bool(more)
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise MigrationException(
+                "Expected one of [%s] but found [%s]" % (chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise
+            # incomplete value: grow the buffer geometrically
+            self._fill(len(self.buf) - self.pos)
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            table = self.value()
+            self.expect(':')
+            self.expect('{')
+            if self.peek() == '}':
+                self.pos += 1
+            else:
+                while True:
+                    doc_id = self.value()
+                    self.expect(':')
+                    yield table, doc_id, self.value()
+                    if self.expect(',}') == '}':
+                        break
+            if self.expect(',}') == '}':
+                return
+
+
+def read_json(path, progress=None, exp_id=None):
+    total = float(os.path.getsize(path)) or 1.0
+    with open(path, 'r') as f:
+        reader = _JSONStreamReader(f)
+        for item in reader:
+            yield item
+            if progress is not None:
+                progress(min(reader.consumed / total, 1.0))
+
+
+def read_jsonl(path, progress=None, exp_id=None):
+    total = float(os.path.getsize(path)) or 1.0
+    with open(path, 'r') as f:
+        f.readline()            # header
+        consumed = 0
+        for line in f:
+            consumed += len(line)
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["table"], entry["id"], entry["doc"]
+                if progress is not None:
+                    progress(min(consumed / total, 1.0))
+
+
+def has_exp_id(conn):
+    columns = conn.execute("PRAGMA table_info(documents)").fetchall()
+    return any(column[1] == 'exp_id' for column in columns)
+
+
+def read_sqlite(path, progress=None, exp_id=None):
+    conn = sqlite3.connect(path)
+    try:
+        where, args = "", ()
+        # dbs written before the exp_id column was added are scanned
+        if exp_id is not None and has_exp_id(conn):     # indexed lookup
+            where, args = "WHERE exp_id = ? ", (exp_id,)
+        total = float(conn.execute(
+            "SELECT COUNT(*) FROM documents " + where, args).fetchone()[0])
+        total = total or 1.0
+        rows = conn.execute(
+            "SELECT tbl, doc_id, body FROM documents " + where +
+            "ORDER BY tbl, CAST(doc_id AS INTEGER)", args)
+        for done, (table, doc_id, body) in enumerate(rows):
+            yield table, doc_id, json.loads(body)
+            if progress is not None:
+                progress((done + 1) / total)
+    finally:
+        conn.close()
+
+
+READERS = {'json': read_json, 'jsonl': read_jsonl, 'sqlite': read_sqlite}
+
+
+def detect_format(path):
+    with open(path, 'rb') as f:
+        head = f.read(len(SQLITE_MAGIC))
+        if head == SQLITE_MAGIC:
+            return 'sqlite'
+        f.seek(0)
+        if f.readline().lstrip().startswith(b'{"casket"'):
+            return 'jsonl'
+    return 'json'
+
+
+def detect_schema(path, fmt=None):
+    """
+    Returns the schema version of the db at `path`. For json files this
+    takes a streaming pass over the file.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == 'jsonl':
+        with open(path, 'r') as f:
+            return json.loads(f.readline())["casket"]["schema"]
+    if fmt == 'sqlite':
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute(
+                "SELECT value FROM casket WHERE key = 'schema'").fetchone()
+            return int(row[0]) if row else 1
+        finally:
+            conn.close()
+    for table, _, doc in read_json(path):
+        if table == SCHEMA_TABLE:
+            return doc.get("schema", 1)
+    return 1
+
+
+def read(path, progress=None, exp_id=None):
+    """
+    Streams over the documents of a db in any format, leaving out the
+    schema marker
+
+    Parameters:
+    -----------
+    path: str
+    progress: function, optional, see migrate
+    exp_id: str, optional, only read the experiment with this id. Sqlite
+        dbs look it up in an index (if they have one, older sqlite dbs
+        don't), other formats are scanned up to it.
+
+    Returns:
+    --------
+    generator over (table, doc_id, doc)
+    """
+    reader = READERS[detect_format(path)]
+    for table, doc_id, doc in reader(path, progress, exp_id=exp_id):
+        if table == SCHEMA_TABLE:
+            continue
+        if exp_id is None:
+            yield table, doc_id, doc
+        elif doc.get("id") == exp_id:
+            yield table, doc_id, doc
+            return              # experiment ids are unique
+
+
+"""
+Streaming writers
+"""
+
+
+def write_json(path, docs, schema):
+    seen, current = set(), None
+    with open(path, 'w') as f:
+        f.write('{')
+        for table, doc_id, doc in docs:
+            if table != current:
+                if table in seen:
+                    raise MigrationException(
+                        "Documents of table [%s] aren't contiguous" % table)
+                if current is not None:
+                    f.write('}, ')
+                f.write(json.dumps(table) + ': {')
+                seen.add(table)
+                current, first = table, True
+            if not first:
+                f.write(', ')
+            f.write(json.dumps(str(doc_id)) + ': ' + json.dumps(doc))
+            first = False
+        if current is not None:
+            f.write('}, ')
+        f.write(json.dumps(SCHEMA_TABLE) + ': ' +
+                json.dumps({"1": {"schema": schema}}) + '}')
+
+
+def write_jsonl(path, docs, schema):
+    with open(path, 'w') as f:
+        f.write(json.dumps({"casket": {"schema": schema}}) + '\n')
+        for table, doc_id, doc in docs:
+            f.write(json.dumps(
+                {"table": table, "id": str(doc_id), "doc": doc}) + '\n')
+
+
+def write_sqlite(path, docs, schema, batch_size=1000):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE casket (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE documents (tbl TEXT, doc_id TEXT, "
+                     "exp_id TEXT, body TEXT, PRIMARY KEY (tbl, doc_id))")
+        conn.execute("INSERT INTO casket VALUES ('schema', ?)", (schema,))
+        batch = []
+        for table, doc_id, doc in docs:
+            batch.append((table, str(doc_id), doc.get("id"), json.dumps(doc)))
+            if len(batch) >= batch_size:
+                conn.executemany(
+                    "INSERT INTO documents VALUES (?, ?, ?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", batch)
+        conn.execute("CREATE INDEX documents_exp_id ON documents (exp_id)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+WRITERS = {'json': write_json, 'jsonl': write_jsonl, 'sqlite': write_sqlite}
+
+
+def migrate(source, target, fmt=None, schema=None, progress=None):
+    """
+    Converts the db at `source` into a db at `target`, in a single streaming
+    pass over its documents (plus one to detect the schema of json files).
+    `target` is written to a temporary file first, and is only replaced
+    once the migration succeeds.
+
+    Parameters:
+    -----------
+    source: str, path to a db in any format
+    target: str, output path
+    fmt: str, output format (one of FORMATS), defaults to the source's
+    schema: int, output schema version, defaults to SCHEMA_VERSION
+    progress: function, called with the fraction of the source processed
+
+    Returns:
+    --------
+    int, number of migrated documents
+    """
+    source_fmt = detect_format(source)
+    fmt = fmt or source_fmt
+    schema = SCHEMA_VERSION if schema is None else schema
+    if fmt not in FORMATS:
+        raise MigrationException("Unknown format [%s]" % str(fmt))
+    steps = plan(detect_schema(source, source_fmt), schema)
+    if os.path.realpath(source) == os.path.realpath(target):
+        raise MigrationException("Source and target must be different")
+    count = [0]
+
+    def docs():
+        for table, doc_id, doc in read(source, progress=progress):
+            for step in steps:
+                step(doc)
+            count[0] += 1
+            yield table, doc_id, doc
+
+    tmp = target + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        WRITERS[fmt](tmp, docs(), schema)
+        replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return count[0]
@@ -1,4 +1,4 @@
 
 from __future__ import absolute_import
 from .corpus import Corpus
-from .indexer import Indexer
+from .indexer import Indexer, HashingIndexer
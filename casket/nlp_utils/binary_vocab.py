@@ -0,0 +1,183 @@
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping, Sequence
+
+FORMAT_VERSION = 1
+
+MAGIC = b'CASKVOC\x00'
+
+_HEADER = struct.Struct('<8sI')     # magic, length of the JSON header
+
+
+def _hash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+
+def write(path, items, header):
+    """
+    Writes a vocabulary of str items (item i having code i) to a binary
+    file, laid out as:
+
+        magic, JSON header (padded to 8 bytes)
+        offsets: uint64[n + 1], byte offsets of each item into the blob
+        buckets: int32[n_buckets], open addressing hash table (crc32 of
+            the UTF-8 item, linear probing) from item to code, -1 if empty
+        blob: the UTF-8 encoded items, concatenated
+
+    The file is written next to `path` and then moved into place, so that
+    processes with the old file mapped keep reading consistent data.
+
+    Parameters:
+    -----------
+    path: str
+    items: sequence of str
+    header: dict, extra header fields (e.g. reserved items)
+    """
+    encoded = []
+    for item in items:
+        if not isinstance(item, str):
+            raise ValueError(
+                "Binary format requires str items but got [%s]" % repr(item))
+        encoded.append(item.encode('utf-8'))
+    n_buckets = 1
+    while n_buckets < 2 * len(encoded):    # load factor of at most 0.5
+        n_buckets *= 2
+    mask = n_buckets - 1
+    buckets = array('i', [-1]) * n_buckets
+    offsets = array('Q', [0])
+    for code, key in enumerate(encoded):
+        slot = _hash(key) & mask
+        while buckets[slot] != -1:
+            slot = (slot + 1) & mask
+        buckets[slot] = code
+        offsets.append(offsets[-1] + len(key))
+    header = dict(header, version=FORMAT_VERSION, byteorder=sys.byteorder,
+                  n_items=len(encoded), n_buckets=n_buckets)
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * (-(_HEADER.size + len(header)) % 8)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(header)))
+        f.write(header)
+        offsets.tofile(f)
+        buckets.tofile(f)
+        for key in encoded:
+            f.write(key)
+    os.replace(tmp, path)
+
+
+class BinaryVocab(object):
+    """
+    Read-only, memory-mapped access to a vocabulary written by `write`.
+    Opening a vocabulary only reads its header: items are looked up in
+    the mapped file, whose pages are shared by all processes reading it.
+    Pickled vocabularies are reopened from their path, so that worker
+    processes share the file instead of receiving copies.
+
+    Parameters:
+    -----------
+    path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError("Not a binary vocabulary [%s]" % path)
+        start = _HEADER.size + size
+        self.header = json.loads(self._mmap[_HEADER.size:start].decode())
+        if self.header['version'] != FORMAT_VERSION or \
+                self.header['byteorder'] != sys.byteorder:
+            raise ValueError("Unsupported binary vocabulary [%s]" % path)
+        n, n_buckets = self.header['n_items'], self.header['n_buckets']
+        view = memoryview(self._mmap)
+        stop = start + 8 * (n + 1)
+        self._offsets = view[start:stop].cast('Q')
+        start, stop = stop, stop + 4 * n_buckets
+        self._buckets = view[start:stop].cast('i')
+        self._blob = stop
+        self._mask = n_buckets - 1
+
+    def __reduce__(self):
+        return BinaryVocab, (self.path,)
+
+    def __len__(self):
+        return self.header['n_items']
+
+    def item(self, code):
+        start = self._blob + self._offsets[code]
+        stop = self._blob + self._offsets[code + 1]
+        return self._mmap[start:stop].decode('utf-8')
+
+    def code(self, item):
+        """
+        Returns the code of `item`, or None if it isn't in the vocabulary
+        """
+        if not isinstance(item, str):
+            return None
+        key = item.encode('utf-8')
+        slot = _hash(key) & self._mask
+        while True:
+            code = self._buckets[slot]
+            if code == -1:
+                return None
+            start = self._blob + self._offsets[code]
+            stop = self._blob + self._offsets[code + 1]
+            if self._mmap[start:stop] == key:
+                return code
+            slot = (slot + 1) & self._mask
+
+
+class VocabEncoder(Mapping):
+    """
+    Mapping view {item: code} of a BinaryVocab, for Indexer.encoder
+    """
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __getitem__(self, item):
+        code = self.vocab.code(item)
+        if code is None:
+            raise KeyError(item)
+        return code
+
+    def __contains__(self, item):
+        return self.vocab.code(item) is not None
+
+    def get(self, item, default=None):
+        code = self.vocab.code(item)
+        return default if code is None else code
+
+    def __iter__(self):
+        for code in range(len(self.vocab)):
+            yield self.vocab.item(code)
+
+    def __len__(self):
+        return len(self.vocab)
+
+
+class VocabDecoder(Sequence):
+    """
+    Sequence view [code -> item] of a BinaryVocab, for Indexer.decoder
+    """
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __getitem__(self, code):
+        if isinstance(code, slice):
+            return [self[i] for i in range(*code.indices(len(self)))]
+        if code < 0:
+            code += len(self)
+        if not 0 <= code < len(self):
+            raise IndexError("Code [%d] out of range" % code)
+        return self.vocab.item(code)
+
+    def __len__(self):
+        return len(self.vocab)
@@ -0,0 +1,148 @@
+
+import json
+import os
+
+FORMAT_VERSION = 1
+
+UNITS, OFFSETS, MANIFEST = 'units.npy', 'offsets.npy', 'manifest.json'
+
+
+def source_stats(fnames):
+    """
+    Returns [fname, size, mtime_ns] for each source file, used to detect
+    changes to the sources of a cache
+    """
+    stats = []
+    for fname in fnames:
+        st = os.stat(fname)
+        stats.append([os.path.realpath(fname), st.st_size, st.st_mtime_ns])
+    return stats
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def build(path, lines, encode, manifest, chunk_size=1 << 20):
+    """
+    Encodes `lines` into a cache at directory `path`: a flat int32 array
+    of units (units.npy) and the offsets of each line into it (int64,
+    offsets.npy, one more than lines), plus a manifest describing what was
+    encoded. Units are written to disk as they are encoded, so memory use
+    doesn't grow with the size of the corpus. The manifest is written
+    last, so an interrupted build leaves an invalid cache.
+
+    Parameters:
+    -----------
+    path: str, cache directory (created if missing)
+    lines: iterable of lines
+    encode: function from a line to an int32 array of units
+    manifest: dict, stored as the cache's manifest (see Corpus.build_cache)
+    chunk_size: int, units copied at once into units.npy
+    """
+    import numpy as np
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    raw = os.path.join(path, UNITS + '.tmp')
+    offsets = [0]
+    with open(raw, 'wb') as f:
+        for line in lines:
+            units = encode(line)
+            f.write(units.tobytes())
+            offsets.append(offsets[-1] + len(units))
+    try:
+        n = offsets[-1]
+        out = np.lib.format.open_memmap(
+            os.path.join(path, UNITS), mode='w+', dtype=np.int32,
+            shape=(n,))
+        for start in range(0, n, chunk_size):
+            count = min(chunk_size, n - start)
+            out[start:start + count] = np.fromfile(
+                raw, dtype=np.int32, count=count, offset=4 * start)
+        out.flush()
+        del out
+    finally:
+        os.remove(raw)
+    np.save(os.path.join(path, OFFSETS), np.array(offsets, dtype=np.int64))
+    manifest = dict(manifest, version=FORMAT_VERSION,
+                    n_lines=len(offsets) - 1, n_units=offsets[-1])
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+
+class CorpusCache(object):
+    """
+    Read access to a corpus encoded by `build`. Arrays are memory-mapped,
+    so opening a cache is cheap and pages are shared between processes.
+
+    Parameters:
+    -----------
+    path: str, cache directory
+    """
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        self.manifest = read_manifest(path)
+        if self.manifest is None:
+            raise ValueError("No valid cache at [%s]" % path)
+        self.units = np.load(os.path.join(path, UNITS), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, OFFSETS), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, idx):
+        """
+        Returns the encoded units of line `idx` (a view over the cache)
+        """
+        return self.units[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def generate_arrays(self, context, side, pad_code, concat=True,
+                        block_size=1 << 16):
+        """
+        Yields the context windows of all lines, as Corpus.generate_arrays,
+        but for blocks of lines of about `block_size` units at a time.
+        Each block is copied into a buffer with `context` pads around each
+        line, from which all windows are gathered at once.
+
+        Returns:
+        --------
+        generator over (contexts, targets)
+        """
+        import numpy as np
+        k = context
+        if side == 'left':
+            rel = np.arange(-k, 0)
+        elif side == 'right':
+            rel = np.arange(1, k + 1)
+        else:
+            rel = np.concatenate([np.arange(-k, 0), np.arange(1, k + 1)])
+        offsets, n_lines = np.asarray(self.offsets), len(self)
+        first = 0
+        while first < n_lines:
+            last = int(np.searchsorted(
+                offsets, offsets[first] + block_size, side='right')) - 1
+            last = min(max(last, first + 1), n_lines)
+            start, stop = offsets[first], offsets[last]
+            if stop > start:
+                targets = np.array(self.units[start:stop])
+                lengths = np.diff(offsets[first:last + 1])
+                # position of each unit in the padded buffer
+                pos = np.arange(stop - start) + k * (1 + np.repeat(
+                    np.arange(last - first), lengths))
+                padded = np.full(len(targets) + k * (last - first + 1),
+                                 pad_code, dtype=np.int32)
+                padded[pos] = targets
+                contexts = padded[pos[:, None] + rel]
+                if side == 'both' and not concat:
+                    yield (contexts[:, :k], contexts[:, k:]), targets
+                else:
+                    yield contexts, targets
+            first = last
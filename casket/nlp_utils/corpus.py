@@ -1,6 +1,10 @@
 
+import logging
 import os
 import types
+from collections import Counter
+
+LOGGER = logging.getLogger(__name__)
 
 
 def lines_from_file(fname):
@@ -25,6 +29,65 @@ def lines_from_root(root):
         raise ValueError("Unknown root type [%s]" % type(root))
 
 
+def decode_line(line, encoding='utf-8'):
+    """
+    Decodes a line read in binary mode, translating its line ending to
+    '\\n' as files read in text mode do (see lines_from_file)
+    """
+    line = line.decode(encoding)
+    if line.endswith('\r\n'):
+        return line[:-2] + '\n'
+    if line.endswith('\r'):
+        return line[:-1] + '\n'
+    return line
+
+
+def lines_from_range(fname, start, end, encoding='utf-8'):
+    """
+    Yields the lines of a file starting within byte range [start, end),
+    with their line endings translated to '\\n' (see decode_line)
+    """
+    with open(fname, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()        # skip to the first line starting in range
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield decode_line(line, encoding)
+
+
+def files_from_root(root):
+    """
+    Returns the files under `root` (file or dir), in the order in which
+    lines_from_root reads them
+    """
+    if isinstance(root, str):
+        if os.path.isdir(root):
+            return [os.path.join(root, f) for f in os.listdir(root)]
+        elif os.path.isfile(root):
+            return [root]
+    raise ValueError("Expected a file or dir root but got [%s]" % str(root))
+
+
+def shards_from_root(root, shard_size):
+    """
+    Splits the files under `root` (file or dir) into byte ranges of at most
+    `shard_size` bytes, in the order in which lines_from_root reads them
+
+    Returns:
+    --------
+    generator over (fname, start, end), see lines_from_range
+    """
+    for fname in files_from_root(root):
+        size = os.path.getsize(fname)
+        for start in range(0, size, shard_size):
+            yield fname, start, min(start + shard_size, size)
+
+
 def pad(items, maxlen, paditem=0, paddir='left'):
     """
     Parameters:
@@ -45,6 +108,176 @@ def pad(items, maxlen, paditem=0, paddir='left'):
         raise ValueError("Unknown pad direction [%s]" % str(paddir))
 
 
+def encode_array(units, indexer, **kwargs):
+    """
+    Encodes a sequence of units into an int32 array. Requires NumPy.
+
+    Parameters:
+    -----------
+    units: generator/list, a seq of units to be encoded
+    indexer: Indexer, a fitted indexer
+    kwargs: optional arguments for Indexer.encode
+    """
+    import numpy as np
+    if not kwargs:
+        # lookup table for strings over character vocabularies
+        return indexer.encode_array(units)
+    if not isinstance(units, (list, tuple, str)):
+        units = list(units)
+    codes = (indexer.encode(c, **kwargs) for c in units)
+    return np.fromiter(codes, dtype=np.int32, count=len(units))
+
+
+class _BatchFiller(object):
+    """
+    Copies chunks of instances into preallocated batch buffers, so that no
+    memory is allocated per instance. With `buffers=None`, each batch gets
+    a new buffer. Otherwise buffers are reused in a ring of `buffers`, so
+    that no memory is allocated per batch either, and a yielded batch is
+    overwritten once all other buffers have been filled.
+    """
+    def __init__(self, batch_size, width, buffers=None):
+        self.batch_size, self.width = batch_size, width
+        self.reuse = buffers is not None
+        self.buffers = [self._allocate()
+                        for _ in range(max(1, buffers or 1))]
+        self.current, self.pos = 0, 0
+
+    def _allocate(self):
+        import numpy as np
+        return (np.empty((self.batch_size, self.width), dtype=np.int32),
+                np.empty(self.batch_size, dtype=np.int32))
+
+    def add(self, contexts, targets):
+        """
+        Returns:
+        --------
+        generator over the batches filled up by the chunk
+        """
+        start, n = 0, len(targets)
+        while start < n:
+            batch_contexts, batch_targets = self.buffers[self.current]
+            take = min(n - start, self.batch_size - self.pos)
+            stop = self.pos + take
+            batch_contexts[self.pos:stop] = contexts[start:start + take]
+            batch_targets[self.pos:stop] = targets[start:start + take]
+            self.pos, start = stop, start + take
+            if self.pos == self.batch_size:
+                yield batch_contexts, batch_targets
+                if self.reuse:
+                    self.current = (self.current + 1) % len(self.buffers)
+                else:
+                    self.buffers[self.current] = self._allocate()
+                self.pos = 0
+
+    def flush(self):
+        """
+        Returns the last (partial) batch or None if empty
+        """
+        if not self.pos:
+            return None
+        batch_contexts, batch_targets = self.buffers[self.current]
+        batch = batch_contexts[:self.pos], batch_targets[:self.pos]
+        self.pos = 0
+        return batch
+
+
+class _ShuffleBuffer(object):
+    """
+    Bounded shuffle buffer over chunks of instances. Once full, each
+    incoming instance takes the slot of a random stored instance, which is
+    emitted instead. Slots are drawn per chunk, so the cost is per chunk
+    rather than per instance.
+    """
+    def __init__(self, size, width, rng):
+        import numpy as np
+        self.contexts = np.empty((size, width), dtype=np.int32)
+        self.targets = np.empty(size, dtype=np.int32)
+        self.size, self.n, self.rng = size, 0, rng
+
+    def add(self, contexts, targets):
+        """
+        Returns:
+        --------
+        generator over chunks of shuffled (contexts, targets)
+        """
+        import numpy as np
+        n = len(targets)
+        start = min(n, self.size - self.n)       # fill up free slots first
+        self.contexts[self.n:self.n + start] = contexts[:start]
+        self.targets[self.n:self.n + start] = targets[:start]
+        self.n += start
+        while start < n:
+            # distinct slots, so that no incoming instance is overwritten
+            slots = np.unique(self.rng.randint(
+                0, self.size, min(n - start, self.size)))
+            stop = start + len(slots)
+            yield self.contexts[slots], self.targets[slots]  # copies
+            self.contexts[slots] = contexts[start:stop]
+            self.targets[slots] = targets[start:stop]
+            start = stop
+
+    def drain(self):
+        perm = self.rng.permutation(self.n)
+        self.n = 0
+        return self.contexts[perm], self.targets[perm]
+
+
+# state of worker processes in parallel mode, see Corpus._parallel_arrays
+_worker = {}
+
+
+def _init_worker(context, side, indexer, kwargs):
+    _worker.update(corpus=Corpus(None, context=context, side=side),
+                   indexer=indexer, kwargs=kwargs)
+
+
+def _encode_shard(shard):
+    """
+    Encodes a shard into a new shared memory block holding the contexts
+    followed by the targets. The block is unlinked by the parent process.
+
+    Returns:
+    --------
+    (name, n_instances), or (None, 0) for shards without instances
+    """
+    import numpy as np
+    from multiprocessing.shared_memory import SharedMemory
+    arrays = list(_worker['corpus']._arrays_from_lines(
+        lines_from_range(*shard), indexer=_worker['indexer'],
+        **_worker['kwargs']))
+    n = sum(len(targets) for _, targets in arrays)
+    if not n:
+        return None, 0
+    width = arrays[0][0].shape[1]
+    shm = SharedMemory(create=True, size=4 * n * (width + 1))
+    try:
+        contexts = np.ndarray((n, width), dtype=np.int32, buffer=shm.buf)
+        targets = np.ndarray((n,), dtype=np.int32, buffer=shm.buf,
+                             offset=contexts.nbytes)
+        start = 0
+        for chunk_contexts, chunk_targets in arrays:
+            stop = start + len(chunk_targets)
+            contexts[start:stop] = chunk_contexts
+            targets[start:stop] = chunk_targets
+            start = stop
+        del contexts, targets   # no views may outlive the block
+    finally:
+        shm.close()
+    # the parent process owns the block from now on: keep this process'
+    # resource tracker from unlinking it when the worker exits
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm.name, n
+
+
+def _count_shard(shard, mode='chars', tokenizer=None):
+    counts = Counter()
+    for line in lines_from_range(*shard):
+        counts.update(Corpus._units(line, mode, tokenizer))
+    return counts
+
+
 class Corpus(object):
     def __init__(self, root, context=10, side='both'):
         """
@@ -59,6 +292,8 @@ class Corpus(object):
         if side not in {'left', 'right', 'both'}:
             raise ValueError('Invalid side value [%s]' % side)
         self.side = side
+        self._cache, self._cache_key = None, None
+        self._line_index = None
 
     def _pad_encode(self, line, indexer, concat=True, **kwargs):
         """
@@ -94,6 +329,108 @@ class Corpus(object):
                 else:
                     yield (left, right), c
 
+    def _pad_encode_array(self, line, indexer, concat=True, **kwargs):
+        """
+        Vectorized version of _pad_encode over a whole line. The line is
+        encoded into an int32 array, padded once on both sides and all
+        context windows are taken from a strided view over it, so there
+        are no per-unit allocations. Requires NumPy.
+
+        Parameters:
+        -----------
+        line: generator/list, a seq of units to be padded/encoded
+        indexer: Indexer, a fitted indexer
+        concat: bool, whether to concat left & right contexts or not
+        kwargs: optional arguments for Indexer.encode
+
+        Returns:
+        --------
+        (contexts, targets), with contexts an int32 array of shape
+            (len(line), context) (or (len(line), 2 * context) for concat
+            left & right contexts, or a tuple (left, right) otherwise) and
+            targets an int32 array of shape (len(line),). Single side
+            contexts are read-only views.
+        """
+        import numpy as np
+        from numpy.lib.stride_tricks import as_strided
+        targets = encode_array(line, indexer, **kwargs)
+        n, k = len(targets), self.context
+        padded = np.full(n + 2 * k, indexer.pad_code, dtype=np.int32)
+        padded[k:k + n] = targets
+        # row i is the window centered on unit i: padded[i:i + 2k + 1]
+        stride = padded.strides[0]
+        windows = as_strided(padded, shape=(n, 2 * k + 1),
+                             strides=(stride, stride), writeable=False)
+        left, right = windows[:, :k], windows[:, k + 1:]
+        if self.side == 'left':
+            return left, targets
+        if self.side == 'right':
+            return right, targets
+        if concat:
+            return np.concatenate([left, right], axis=1), targets
+        return (left, right), targets
+
+    def build_line_index(self, path=None, force=False):
+        """
+        Indexes the byte offsets of all lines under the (file or dir) root
+        (see line_index.LineIndex), enabling iter_lines and epoch. If `path`
+        is given, the index is stored there and reused as long as the
+        source files keep their size and mtime. Requires NumPy.
+
+        Parameters:
+        -----------
+        path: str, optional, file to store the index in (.npz)
+        force: bool, rebuild even if the stored index is valid
+
+        Returns:
+        --------
+        line_index.LineIndex
+        """
+        from .line_index import LineIndex
+        fnames, index = files_from_root(self.root), None
+        if path is not None and not force and os.path.isfile(path):
+            index = LineIndex.load(path)
+            if not index.is_valid(fnames):
+                index = None
+        if index is None:
+            LOGGER.info("Building line index for [%s]" % self.root)
+            index = LineIndex.build(fnames)
+            if path is not None:
+                index.save(path)
+        self._line_index = index
+        return index
+
+    def iter_lines(self, shuffle=False, seed=None, num_shards=1, shard_id=0,
+                   start=0):
+        """
+        Yields the lines of the corpus in the order given by
+        LineIndex.order, reading them by offset instead of front to back,
+        so that shuffling doesn't require loading the corpus into memory.
+        Builds an in-memory line index if build_line_index wasn't called.
+        """
+        if self._line_index is None:
+            self.build_line_index()
+        order = self._line_index.order(
+            shuffle=shuffle, seed=seed, num_shards=num_shards,
+            shard_id=shard_id, start=start)
+        return self._line_index.iter_lines(order)
+
+    def epoch(self, shuffle=True, seed=None, num_shards=1, shard_id=0,
+              start=0):
+        """
+        Returns a Corpus over the lines of an epoch (see iter_lines), with
+        the same settings as this one, e.g.:
+
+        for epoch in range(10):
+            for batch in corpus.epoch(seed=epoch).generate_array_batches(
+                    indexer=indexer):
+                ...
+        """
+        return Corpus(self.iter_lines(shuffle=shuffle, seed=seed,
+                                      num_shards=num_shards,
+                                      shard_id=shard_id, start=start),
+                      context=self.context, side=self.side)
+
     def chars(self):
         for line in lines_from_root(self.root):
             for c in line:
@@ -108,6 +445,42 @@ class Corpus(object):
                 for word in line.split():
                     yield word
 
+    def counts(self, mode='chars', tokenizer=None, n_jobs=1,
+               shard_size=1 << 22):
+        """
+        Counts the units (chars or words) of the corpus. With `n_jobs` > 1,
+        byte ranges of the input files (see shards_from_root) are counted
+        by a pool of processes and their counts merged as they come in.
+
+        Parameters:
+        -----------
+        mode: str, one of 'chars', 'words'
+        tokenizer: function, optional, see words. Must be picklable (e.g.
+            a module-level function) if n_jobs > 1.
+        n_jobs: int, number of processes. Requires a file or dir root.
+        shard_size: int, bytes of input per parallel task
+
+        Returns:
+        --------
+        collections.Counter, with units in order of first appearance
+        """
+        self._units('', mode)   # fail early on unknown modes
+        if n_jobs <= 1:
+            counts = Counter()
+            for line in lines_from_root(self.root):
+                counts.update(self._units(line, mode, tokenizer))
+            return counts
+        from concurrent.futures import ProcessPoolExecutor
+        from functools import partial
+        counts = Counter()
+        with ProcessPoolExecutor(n_jobs) as pool:
+            # shards are merged in order, keeping the order of appearance
+            for shard_counts in pool.map(
+                    partial(_count_shard, mode=mode, tokenizer=tokenizer),
+                    shards_from_root(self.root, shard_size)):
+                counts.update(shard_counts)
+        return counts
+
     def generate(self, mode='chars', tokenizer=None, indexer=None, **kwargs):
         """
         Returns:
@@ -125,28 +498,288 @@ class Corpus(object):
             else:
                 raise ValueError("Unknown mode [%s]" % str(mode))
 
-    def generate_batches(self, batch_size=128, **kwargs):
+    def generate_arrays(self, mode='chars', tokenizer=None, indexer=None,
+                        **kwargs):
+        """
+        Like generate, but yields all instances of a line at once as NumPy
+        arrays (see _pad_encode_array). If the corpus has been cached (see
+        build_cache), instances are read from the cache in blocks of lines.
+
+        Returns:
+        --------
+        generator (contexts, targets) over lines (or blocks of lines)
+        """
+        cached = self._cached_arrays(
+            mode=mode, tokenizer=tokenizer, indexer=indexer, **kwargs)
+        if cached is not None:
+            return cached
+        return self._arrays_from_lines(
+            lines_from_root(self.root), mode=mode, tokenizer=tokenizer,
+            indexer=indexer, **kwargs)
+
+    @staticmethod
+    def _units(line, mode='chars', tokenizer=None):
+        if mode == 'chars':
+            return line
+        elif mode == 'words':
+            return tokenizer(line) if tokenizer else line.split()
+        raise ValueError("Unknown mode [%s]" % str(mode))
+
+    def _arrays_from_lines(self, lines, mode='chars', tokenizer=None,
+                           indexer=None, **kwargs):
+        for line in lines:
+            yield self._pad_encode_array(
+                self._units(line, mode, tokenizer), indexer, **kwargs)
+
+    def build_cache(self, indexer, path, mode='chars', tokenizer=None,
+                    force=False):
+        """
+        Encodes the corpus once into a cache at directory `path` (see
+        cache.build), unless a cache there is still valid: built with the
+        same mode, tokenizer (by name) and indexer vocabulary (see
+        Indexer.vocab_hash) from source files of unchanged size and mtime.
+
+        From then on, generate_arrays and generate_array_batches with the
+        same mode, tokenizer and indexer read windows straight from the
+        memory-mapped cache instead of parsing and encoding text.
+        Requires NumPy and a file or dir root.
+
+        Parameters:
+        -----------
+        indexer: Indexer, a fitted indexer
+        path: str, cache directory
+        mode: str, one of 'chars', 'words'
+        tokenizer: function, optional, see generate
+        force: bool, rebuild even if the cache is valid
+
+        Returns:
+        --------
+        cache.CorpusCache
+        """
+        from .cache import CorpusCache, build, read_manifest, source_stats
+        manifest = {
+            "mode": mode,
+            "tokenizer": getattr(tokenizer, '__name__', None),
+            "vocab_hash": indexer.vocab_hash(),
+            "sources": source_stats(files_from_root(self.root))}
+        current = read_manifest(path) or {}
+        if force or any(current.get(k) != v for k, v in manifest.items()):
+            LOGGER.info("Building corpus cache at [%s]" % path)
+            build(path,
+                  (self._units(line, mode, tokenizer)
+                   for line in lines_from_root(self.root)),
+                  lambda units: encode_array(units, indexer),
+                  manifest)
+        self._cache = CorpusCache(path)
+        self._cache_key = (mode, tokenizer, manifest["vocab_hash"])
+        return self._cache
+
+    def _cached_arrays(self, mode='chars', tokenizer=None, indexer=None,
+                       concat=True, **kwargs):
+        """
+        Returns a generator over windows from the cache (see build_cache),
+        or None if there's no cache for these arguments
+        """
+        if self._cache is None or kwargs or indexer is None:
+            return None
+        if self._cache_key != (mode, tokenizer, indexer.vocab_hash()):
+            return None
+        return self._cache.generate_arrays(
+            self.context, self.side, indexer.pad_code, concat=concat)
+
+    def _parallel_arrays(self, n_jobs, shard_size, indexer=None, **kwargs):
+        """
+        Like generate_arrays, but with shards of the input files encoded by
+        a pool of `n_jobs` processes. Each worker gets a copy of the
+        (fitted) indexer once and sends encoded shards back through shared
+        memory. Shards are collected in order, with up to 2 * n_jobs of
+        them in flight, so the output is the same as with generate_arrays
+        (up to how lines are split into chunks).
+
+        Returns:
+        --------
+        generator over (contexts, targets), views valid until the next
+            item is drawn
+        """
+        import numpy as np
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        from itertools import islice
+        from multiprocessing.shared_memory import SharedMemory
+        if kwargs.get('fitted') is False:
+            raise ValueError("Parallel encoding requires a fitted indexer")
+        if self.side == 'both' and not kwargs.get('concat', True):
+            raise ValueError("Parallel encoding requires concat contexts")
+        width = self.context * (2 if self.side == 'both' else 1)
+        shards = shards_from_root(self.root, shard_size)
+        contexts = targets = None   # reused buffers, grown as needed
+        pool = ProcessPoolExecutor(
+            n_jobs, initializer=_init_worker,
+            initargs=(self.context, self.side, indexer, kwargs))
+        pending = deque(pool.submit(_encode_shard, shard)
+                        for shard in islice(shards, 2 * n_jobs))
+        try:
+            while pending:
+                name, n = pending.popleft().result()
+                for shard in islice(shards, 1):
+                    pending.append(pool.submit(_encode_shard, shard))
+                if not n:
+                    continue
+                if targets is None or len(targets) < n:
+                    size = max(n, 0 if targets is None else 2 * len(targets))
+                    contexts = np.empty((size, width), dtype=np.int32)
+                    targets = np.empty(size, dtype=np.int32)
+                shm = SharedMemory(name=name)
+                try:
+                    shared = np.ndarray((n, width), dtype=np.int32,
+                                        buffer=shm.buf)
+                    contexts[:n] = shared
+                    targets[:n] = np.ndarray((n,), dtype=np.int32,
+                                             buffer=shm.buf,
+                                             offset=shared.nbytes)
+                    del shared  # no views may outlive the block
+                finally:
+                    shm.close()
+                    shm.unlink()
+                yield contexts[:n], targets[:n]
+        finally:
+            # e.g. the consumer stopped early: free blocks still in flight
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                name, n = future.result()
+                if name is not None:
+                    shm = SharedMemory(name=name)
+                    shm.close()
+                    shm.unlink()
+            pool.shutdown()
+
+    def generate_batches(self, batch_size=128, drop_last=True, **kwargs):
         """
         Parameters:
         -----------
         batch_size: int
+        drop_last: bool, whether to leave out the last batch if incomplete
+            (default), so that all batches have `batch_size` instances
         kwargs: optional arguments for Corpus.generate and Indexer.encode
 
         Returns:
         --------
         generator (list:list:int, list:int) over batches of instances
         """
-        contexts, targets, n = [], [], 0
-        generator = self.generate(**kwargs)
-        while True:
-            try:
-                context, target = next(generator)
-                if n % batch_size == 0 and contexts:
-                    yield contexts, targets
-                    contexts, targets = [], []
-                else:
-                    contexts.append(context)
-                    targets.append(target)
-                    n += 1
-            except StopIteration:
-                break
+        contexts, targets = [], []
+        for context, target in self.generate(**kwargs):
+            contexts.append(context)
+            targets.append(target)
+            if len(targets) == batch_size:
+                yield contexts, targets
+                contexts, targets = [], []
+        if targets and not drop_last:
+            yield contexts, targets
+
+    def prefetch(self, batch_size=128, depth=4, worker='thread', arrays=True,
+                 **kwargs):
+        """
+        Produces batches in the background (see prefetch.Prefetcher), so
+        that reading, encoding and padding the next batches overlaps with
+        training on the current one, e.g.:
+
+        with corpus.prefetch(indexer=indexer, depth=8) as batches:
+            for contexts, targets in batches:
+                model.train_on_batch(contexts, targets)
+
+        With a thread worker, array batches are drawn from a ring of
+        `depth + 2` buffers, so that a batch stays valid until the next one
+        is drawn. A process worker requires a file or dir root (and
+        picklable arguments, e.g. a module-level tokenizer).
+
+        Parameters:
+        -----------
+        batch_size: int
+        depth: int, max number of batches produced ahead
+        worker: str, one of 'thread', 'process' (see Prefetcher's mode)
+        arrays: bool, whether to prefetch generate_array_batches (default)
+            or generate_batches
+        kwargs: optional arguments for the batch generator
+
+        Returns:
+        --------
+        prefetch.Prefetcher, an iterator over batches
+        """
+        from functools import partial
+        from .prefetch import Prefetcher
+        if worker == 'process' and not isinstance(self.root, str):
+            raise ValueError("Process prefetching requires a file/dir root")
+        if arrays:
+            if worker == 'thread':
+                kwargs.setdefault('buffers', depth + 2)
+            factory = partial(self.generate_array_batches,
+                              batch_size=batch_size, **kwargs)
+        else:
+            factory = partial(self.generate_batches,
+                              batch_size=batch_size, **kwargs)
+        return Prefetcher(factory, depth=depth, mode=worker)
+
+    def generate_array_batches(self, batch_size=128, drop_last=True,
+                               shuffle_buffer=0, buffers=None, seed=None,
+                               n_jobs=1, shard_size=1 << 20, **kwargs):
+        """
+        Like generate_batches, but fills preallocated int32 arrays (see
+        _BatchFiller) from the NumPy path (see generate_arrays). Requires
+        NumPy and concatenated contexts.
+
+        By default, each batch is a new pair of arrays, which consumers can
+        keep around (e.g. in the queue of Keras' fit_generator). Passing
+        `buffers` opts into a ring of `buffers` reused buffers, which saves
+        an allocation per batch but yields views: a batch is only valid
+        until `buffers - 1` more batches have been drawn, so consumers
+        keeping batches around must copy them or use more buffers.
+
+        Parameters:
+        -----------
+        batch_size: int
+        drop_last: bool, whether to leave out the last batch if incomplete
+            (default), so that all batches have `batch_size` instances
+        shuffle_buffer: int, size of the shuffle buffer (0 doesn't shuffle)
+        buffers: int, optional, number of reused batch buffers (e.g. 2 for
+            double-buffering, if each batch is consumed before the next
+            one is drawn)
+        seed: int, optional, seed for shuffling
+        n_jobs: int, number of processes encoding the input in parallel
+            (see _parallel_arrays). Requires a file or dir root, and a
+            picklable tokenizer (e.g. a module-level function).
+        shard_size: int, bytes of input per parallel task
+        kwargs: optional arguments for Corpus.generate_arrays
+
+        Returns:
+        --------
+        generator over (contexts, targets) batches, with contexts an int32
+            array of shape (batch_size, width) and targets of (batch_size,)
+        """
+        import numpy as np
+        if self.side == 'both' and not kwargs.get('concat', True):
+            raise ValueError("Array batches require concat contexts")
+        width = self.context * (2 if self.side == 'both' else 1)
+        filler = _BatchFiller(batch_size, width, buffers=buffers)
+        shuffler = None
+        if shuffle_buffer:
+            shuffler = _ShuffleBuffer(
+                shuffle_buffer, width, np.random.RandomState(seed))
+        if n_jobs > 1 and self._cached_arrays(**kwargs) is None:
+            arrays = self._parallel_arrays(n_jobs, shard_size, **kwargs)
+        else:
+            arrays = self.generate_arrays(**kwargs)
+        for contexts, targets in arrays:
+            chunks = [(contexts, targets)] if shuffler is None else \
+                shuffler.add(contexts, targets)
+            for chunk_contexts, chunk_targets in chunks:
+                for batch in filler.add(chunk_contexts, chunk_targets):
+                    yield batch
+        if shuffler is not None:
+            for batch in filler.add(*shuffler.drain()):
+                yield batch
+        last = filler.flush()
+        if last is not None and not drop_last:
+            yield last
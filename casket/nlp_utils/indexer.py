@@ -1,5 +1,6 @@
 
 import logging
+import hashlib
 import json
 
 try:
@@ -26,9 +27,10 @@ class Indexer(object):
         self.level = logging.WARN if verbose else logging.NOTSET
         self.pad = pad
         self.oov = oov
-        self.decoder = {}
+        self.decoder = []       # code -> item
         self.encoder = {}
         self._current = 0
+        self._table, self._decoder_array, self._hash = None, None, None
         if pad:
             self.pad = pad
             self.pad_code = self.encode(pad, fitted=False)
@@ -42,6 +44,19 @@ class Indexer(object):
     def vocab_len(self):
         return len(self.encoder)
 
+    def vocab_hash(self):
+        """
+        Returns a hash of the mapping between items and codes (and of the
+        reserved items), e.g. to validate data encoded with this indexer.
+        The hash is computed once and cleared when items are inserted.
+        """
+        if self._hash is None:
+            items = sorted(self.encoder.items(), key=lambda item: item[1])
+            obj = [self.pad, self.oov, [[str(s), idx] for s, idx in items]]
+            self._hash = hashlib.sha1(
+                json.dumps(obj).encode('utf-8')).hexdigest()
+        return self._hash
+
     def set_verbose(self, verbose=True):
         self.level = logging.WARN if verbose else logging.NOTSET
 
@@ -49,6 +64,46 @@ class Indexer(object):
         self.fitted = True
         return self.encode_seq(seq, fitted=False)
 
+    def fit_counts(self, corpus, mode='chars', tokenizer=None, min_count=1,
+                   max_size=None, n_jobs=1, shard_size=1 << 22):
+        """
+        Fits the indexer on the units of a corpus in order of decreasing
+        frequency (ties in order of first appearance), leaving out rare
+        units, which are then encoded as OOV.
+
+        Example:
+        --------
+        indexer = Indexer()
+        indexer.fit_counts(Corpus('corpus/'), mode='words', min_count=5,
+                           max_size=50000, n_jobs=4)
+
+        Parameters:
+        -----------
+        corpus: Corpus
+        mode, tokenizer, n_jobs, shard_size: see Corpus.counts
+        min_count: int, minimum count of the units to index
+        max_size: int, optional, maximum vocabulary size (vocab_len),
+            reserved items included
+
+        Returns:
+        --------
+        collections.Counter, counts of all units in the corpus
+        """
+        if not self.oov and (min_count > 1 or max_size is not None):
+            LOGGER.warning("Pruning the vocabulary without OOV item: "
+                           "unknown units won't be encodable")
+        counts = corpus.counts(mode=mode, tokenizer=tokenizer,
+                               n_jobs=n_jobs, shard_size=shard_size)
+        for s, count in counts.most_common():
+            if count < min_count:
+                break       # counts are sorted
+            if max_size is not None and self.vocab_len() >= max_size:
+                break
+            if s not in self.encoder:
+                self.encode(s, fitted=False)
+        self.fitted = True
+        return counts
+
     def transform(self, seq):
         if not self.fitted:
             raise ValueError("Indexer hasn't been fitted yet")
@@ -67,29 +122,168 @@ class Indexer(object):
         --------
         idx (int)
         """
-        if s in self.encoder:
-            return self.encoder[s]
+        idx = self.encoder.get(s)
+        if idx is not None:
+            return idx
         elif fitted:
             if self.oov:
                 return self.oov_code
             else:
                 raise KeyError("Unknown value [%s] with no OOV default" % s)
         else:
-            LOGGER.log(self.level, "Inserting new item [%s]" % s)
+            if self.level:
+                LOGGER.log(self.level, "Inserting new item [%s]" % s)
+            if not isinstance(self.encoder, dict):
+                # read-only binary vocabulary: copy it into memory first
+                self.encoder = dict(self.encoder.items())
+                self.decoder = list(self.decoder)
             idx = self._current
             self.encoder[s] = idx
-            self.decoder[idx] = s
+            self.decoder.append(s)
             self._current += 1
+            self._table, self._decoder_array, self._hash = None, None, None
             return idx
 
     def decode(self, idx):
         return self.decoder[idx]
 
-    def encode_seq(self, seq, **kwargs):
-        return [self.encode(x, **kwargs) for x in seq]
+    def encode_seq(self, seq, fitted=True):
+        if fitted and self.oov:
+            get, oov_code = self.encoder.get, self.oov_code
+            return [get(x, oov_code) for x in seq]
+        return [self.encode(x, fitted=fitted) for x in seq]
+
+    def is_char_vocab(self):
+        """
+        Whether all items are single characters (see lookup_table)
+        """
+        return all(isinstance(s, str) and len(s) == 1 for s in self.encoder)
+
+    def lookup_table(self):
+        """
+        Returns an int32 array mapping code points to codes, with the OOV
+        code (or -1 without OOV) for unknown characters, or None if the
+        vocabulary isn't a character vocabulary. The table is kept until
+        new items are inserted.
+        """
+        import numpy as np
+        if self._table is None:
+            self._table = False     # not a character vocabulary
+            if self.is_char_vocab():
+                size = max([ord(s) for s in self.encoder] or [0]) + 1
+                table = np.full(size, self.oov_code if self.oov else -1,
+                                dtype=np.int32)
+                for s, idx in self.encoder.items():
+                    table[ord(s)] = idx
+                self._table = table
+        return None if self._table is False else self._table
+
+    def encode_array(self, seq, fitted=True):
+        """
+        Vectorized encode. Strings are encoded with the lookup table of
+        character vocabularies at C speed, other sequences (or unfitted
+        encoding) go through the encoder dict. Requires NumPy.
+
+        Parameters:
+        -----------
+        seq: str or sequence of items
+
+        Returns:
+        --------
+        int32 array of codes
+        """
+        import numpy as np
+        table = self.lookup_table() if fitted else None
+        if table is None or not isinstance(seq, str):
+            if not isinstance(seq, (list, tuple, str)):
+                seq = list(seq)
+            return np.fromiter(self.encode_seq(seq, fitted=fitted),
+                               dtype=np.int32, count=len(seq))
+        points = np.frombuffer(seq.encode('utf-32-le', 'surrogatepass'),
+                               dtype=np.uint32)
+        known = points < len(table)
+        codes = table[np.where(known, points, 0)]
+        codes[~known] = self.oov_code if self.oov else -1
+        if not self.oov and (codes < 0).any():
+            unknown = seq[int(np.flatnonzero(codes < 0)[0])]
+            raise KeyError("Unknown value [%s] with no OOV default" % unknown)
+        return codes
+
+    def encode_batch(self, seqs, maxlen=None, paddir='left'):
+        """
+        Encodes a batch of sequences into a 2d int32 array, padded with
+        the padding code as in corpus.pad. Requires NumPy.
+
+        Parameters:
+        -----------
+        seqs: list of str or of sequences of items
+        maxlen: int, optional, length of the padded sequences (longer ones
+            are truncated at the end). Defaults to the longest sequence.
+        paddir: ('left', 'right'), where to add the padding
+        """
+        import numpy as np
+        if paddir not in ('left', 'right'):
+            raise ValueError("Unknown pad direction [%s]" % str(paddir))
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        if maxlen is None:
+            maxlen = int(lengths.max()) if len(seqs) else 0
+        if seqs and all(isinstance(seq, str) for seq in seqs):
+            codes = self.encode_array(''.join(seqs))  # a single lookup
+        else:
+            codes = np.concatenate([np.zeros(0, dtype=np.int32)] +
+                                   [self.encode_array(seq) for seq in seqs])
+        # row of each code and its position within its sequence
+        rows = np.repeat(np.arange(len(seqs)), lengths)
+        cols = np.arange(len(codes)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        keep = cols < maxlen
+        if paddir == 'left':
+            cols = cols + np.repeat(maxlen - np.minimum(lengths, maxlen),
+                                    lengths)
+        batch = np.full((len(seqs), maxlen), self.pad_code, dtype=np.int32)
+        batch[rows[keep], cols[keep]] = codes[keep]
+        return batch
+
+    def decode_array(self, codes):
+        """
+        Vectorized decode. Requires NumPy.
+
+        Parameters:
+        -----------
+        codes: array-like of ints (any shape)
+
+        Returns:
+        --------
+        array of items with the same shape as `codes`. For character
+            vocabularies, ''.join(indexer.decode_array(codes)) gives back
+            the string.
+        """
+        import numpy as np
+        if self._decoder_array is None:
+            if self.is_char_vocab():
+                self._decoder_array = np.array(self.decoder, dtype='<U1')
+            else:
+                self._decoder_array = np.empty(len(self.decoder), dtype=object)
+                self._decoder_array[:] = self.decoder
+        return self._decoder_array[np.asarray(codes)]
+
+    def __setstate__(self, state):
+        # pickles of older versions have a dict decoder {code: item}
+        if isinstance(state.get('decoder'), dict):
+            decoder = state['decoder']
+            state['decoder'] = [decoder[i] for i in range(len(decoder))]
+        state['_table'], state['_decoder_array'] = None, None
+        state['_hash'] = None
+        self.__dict__.update(state)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_table'], state['_decoder_array'] = None, None
+        state['_hash'] = None
+        return state
 
     def _to_json(self):
-        obj = {'encoder': self.encoder, 'decoder': self.decoder}
+        obj = {'encoder': self.encoder, 'decoder': list(self.decoder)}
         if self.pad:
             obj.update({'pad': self.pad, 'pad_code': self.pad_code})
         if self.oov:
@@ -97,9 +291,27 @@ class Indexer(object):
         return obj
 
     def save(self, fname, mode='json'):
+        """
+        Parameters:
+        -----------
+        fname: str
+        mode: str, one of 'json', 'pickle' or 'binary'. Binary files are
+            memory-mapped on load (see binary_vocab), so that loading is
+            near-instant and large vocabularies are stored in memory once
+            per machine, however many processes use them. Only indexers
+            of str items can be saved as binary.
+        """
         if mode == 'json':
             with open(fname, 'w') as f:
                 json.dump(self._to_json(), f)
+        elif mode == 'binary':
+            from .binary_vocab import write
+            header = {}
+            if self.pad:
+                header.update({'pad': self.pad, 'pad_code': self.pad_code})
+            if self.oov:
+                header.update({'oov': self.oov, 'oov_code': self.oov_code})
+            write(fname, self.decoder, header)
         elif mode == 'pickle':
             with open(fname, 'wb') as f:
                 p.dump(self, f)
@@ -114,6 +326,8 @@ class Indexer(object):
         elif mode == 'json':
             with open(fname, 'r') as f:
                 return Indexer.from_dict(json.load(f))
+        elif mode == 'binary':
+            return Indexer.from_binary(fname)
         else:
             raise ValueError('Unrecognized mode %s' % mode)
 
@@ -121,7 +335,14 @@ class Indexer(object):
     def from_dict(cls, d, **kwargs):
         idxr = cls(**kwargs)
         idxr.encoder = d['encoder']
-        idxr.decoder = {int(k): v for (k, v) in d['decoder'].items()}
+        if isinstance(d['decoder'], dict):      # {code: item}, older format
+            decoder = [None] * len(d['decoder'])
+            for k, v in d['decoder'].items():
+                decoder[int(k)] = v
+            idxr.decoder = decoder
+        else:
+            idxr.decoder = list(d['decoder'])
+        idxr._table, idxr._decoder_array, idxr._hash = None, None, None
         idxr.fitted = True
         idxr._current = len(idxr.encoder)
         if 'pad' in d:
@@ -131,3 +352,152 @@ class Indexer(object):
             idxr.oov = d['oov']
             idxr.oov_code = idxr.encode(idxr.oov, fitted=True)
         return idxr
+
+    @classmethod
+    def from_binary(cls, fname):
+        """
+        Loads an indexer saved in binary mode. Its encoder and decoder are
+        read-only views over the memory-mapped file (lookups are slower
+        than with a dict), copied into memory if new items are inserted.
+        """
+        from .binary_vocab import BinaryVocab, VocabEncoder, VocabDecoder
+        vocab = BinaryVocab(fname)
+        idxr = cls(pad=None, oov=None)
+        idxr.encoder = VocabEncoder(vocab)
+        idxr.decoder = VocabDecoder(vocab)
+        idxr.fitted = True
+        idxr._current = len(vocab)
+        for key in ('pad', 'pad_code', 'oov', 'oov_code'):
+            if key in vocab.header:
+                setattr(idxr, key, vocab.header[key])
+        return idxr
+
+
+def _hash_key(seed):
+    # BLAKE2b keys are at most 64 bytes
+    return hashlib.sha256(str(seed).encode('utf-8')).digest()
+
+
+class HashingIndexer(object):
+    def __init__(self, n_buckets=1 << 18, pad='~', oov='±', seed=0,
+                 memo_size=1 << 16):
+        """
+        Indexer using the hashing trick: items are encoded by a stable hash
+        (BLAKE2b of their UTF-8 encoding, keyed by `seed`) into `n_buckets`
+        codes following the reserved ones (pad, then oov). It needs no
+        fitting, and memory use is constant, so it can encode open
+        vocabularies in a single streaming pass (e.g.
+        Corpus.generate(indexer=HashingIndexer())).
+        Codes can't be decoded, and distinct items may share a code.
+
+        Parameters:
+        -----------
+        n_buckets: int, number of codes for (non-reserved) items
+        pad: str, padding item, encoded as 0 (None for no padding)
+        oov: str, reserved OOV item, encoded after pad (None for no OOV)
+        seed: int, key of the hash function: indexers with different seeds
+            hash items independently (e.g. to combine the codes of several
+            indexers into fewer collisions)
+        memo_size: int, number of item codes kept to speed up the encoding
+            of frequent items
+
+        Example:
+        --------
+        indexer = HashingIndexer(n_buckets=100000)
+        for context, target in Corpus('corpus/').generate(
+                mode='words', indexer=indexer):
+            ...
+        """
+        self.n_buckets = n_buckets
+        self.pad = pad
+        self.oov = oov
+        self.seed = seed
+        self._key = _hash_key(seed)
+        self.memo_size = memo_size
+        self.fitted = True
+        self.reserved = {}
+        for item in (pad, oov):
+            if item:
+                self.reserved[item] = len(self.reserved)
+        if pad:
+            self.pad_code = self.reserved[pad]
+        if oov:
+            self.oov_code = self.reserved[oov]
+        self._memo = {}
+
+    def vocab_len(self):
+        return len(self.reserved) + self.n_buckets
+
+    def vocab_hash(self):
+        """
+        Returns a hash of the hashing parameters, see Indexer.vocab_hash
+        """
+        obj = ['hashing-blake2b', self.pad, self.oov, self.n_buckets,
+               self.seed]
+        return hashlib.sha1(json.dumps(obj).encode('utf-8')).hexdigest()
+
+    def fit(self, seq):
+        return self.encode_seq(seq)
+
+    def transform(self, seq):
+        return self.encode_seq(seq)
+
+    def fit_transform(self, seq):
+        return self.encode_seq(seq)
+
+    def encode(self, s, fitted=True):
+        """
+        Parameters:
+        -----------
+        s: object, str or object encoded as str(s)
+        fitted: ignored, for compatibility with Indexer.encode
+
+        Returns:
+        --------
+        idx (int)
+        """
+        if s in self.reserved:
+            return self.reserved[s]
+        # unlike crc32, whose seed only permutes the buckets of items of
+        # the same length, a keyed hash makes collisions depend on the seed
+        h = hashlib.blake2b(
+            str(s).encode('utf-8'), digest_size=8, key=self._key).digest()
+        return len(self.reserved) + int.from_bytes(h, 'little') % \
+            self.n_buckets
+
+    def encode_seq(self, seq, fitted=True):
+        memo, encode, codes = self._memo, self.encode, []
+        for x in seq:
+            code = memo.get(x)
+            if code is None:
+                code = encode(x)
+                if len(memo) < self.memo_size:
+                    memo[x] = code
+            codes.append(code)
+        return codes
+
+    def encode_array(self, seq, fitted=True):
+        """
+        Like encode_seq, but returns an int32 array. Requires NumPy.
+        """
+        import numpy as np
+        return np.array(self.encode_seq(seq), dtype=np.int32)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_memo'] = {}
+        return state
+
+    def __setstate__(self, state):
+        state['_key'] = _hash_key(state['seed'])
+        self.__dict__.update(state)
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump({'n_buckets': self.n_buckets, 'pad': self.pad,
+                       'oov': self.oov, 'seed': self.seed}, f)
+
+    @staticmethod
+    def load(fname):
+        with open(fname, 'r') as f:
+            return HashingIndexer(**json.load(f))
@@ -0,0 +1,136 @@
+
+import json
+import mmap
+
+from .cache import source_stats
+from .corpus import decode_line
+
+
+def file_offsets(fname, buffer_size=1 << 20):
+    """
+    Finds the byte offsets of the lines of a file in one buffered pass
+
+    Returns:
+    --------
+    int64 array with the start of each line plus the file size, so that
+        line i spans bytes [offsets[i], offsets[i + 1])
+    """
+    import numpy as np
+    offsets, pos = [np.zeros(1, dtype=np.int64)], 0
+    with open(fname, 'rb') as f:
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8)
+                                      == ord('\n'))
+            offsets.append(newlines + (pos + 1))
+            pos += len(chunk)
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != pos:      # last line without a newline
+        offsets = np.append(offsets, pos)
+    return offsets
+
+
+class LineIndex(object):
+    """
+    Byte offsets of all lines in a list of files, allowing to read lines
+    in any order. Offsets are stored as a single array of the smallest
+    unsigned type fitting the largest file.
+
+    Example:
+    --------
+    index = LineIndex.build(['a.txt', 'b.txt'])
+    index.save('corpus.idx.npz')
+    for line in index.iter_lines(index.order(shuffle=True, seed=epoch)):
+        ...
+
+    Parameters:
+    -----------
+    sources: list of [fname, size, mtime_ns], see cache.source_stats
+    offsets: array, offsets of all files, concatenated (see file_offsets)
+    counts: array, number of offsets of each file (its lines plus one)
+    """
+    def __init__(self, sources, offsets, counts):
+        import numpy as np
+        self.sources = sources
+        self.offsets = offsets
+        self.counts = np.asarray(counts, dtype=np.int64)
+        # first offset of each file, and first global line id of each file
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.first_lines = np.concatenate(
+            [[0], np.cumsum(self.counts - 1)])
+
+    @classmethod
+    def build(cls, fnames, buffer_size=1 << 20):
+        import numpy as np
+        per_file = [file_offsets(fname, buffer_size) for fname in fnames]
+        largest = max([int(o[-1]) for o in per_file] or [0])
+        dtype = np.uint32 if largest < 2 ** 32 else np.uint64
+        offsets = np.concatenate(per_file or [np.zeros(0)]).astype(dtype)
+        return cls(source_stats(fnames), offsets, [len(o) for o in per_file])
+
+    def save(self, path):
+        import numpy as np
+        with open(path, 'wb') as f:
+            np.savez(f, offsets=self.offsets, counts=self.counts,
+                     sources=np.array(json.dumps(self.sources)))
+
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+        with np.load(path) as data:
+            return cls(json.loads(str(data['sources'])),
+                       data['offsets'], data['counts'])
+
+    def is_valid(self, fnames):
+        """
+        Whether the index is up to date with files `fnames`
+        """
+        try:
+            return source_stats(fnames) == self.sources
+        except OSError:
+            return False
+
+    def __len__(self):
+        return int(self.first_lines[-1])
+
+    def order(self, shuffle=False, seed=None, num_shards=1, shard_id=0,
+              start=0):
+        """
+        Returns the line ids of an epoch: all lines, optionally shuffled,
+        then strided into `num_shards` shards, of which shard `shard_id` is
+        returned from its `start`th line on. Orders are deterministic
+        given a seed, so that an interrupted epoch can be resumed by
+        passing the number of lines already consumed as `start`.
+        """
+        import numpy as np
+        if shuffle:
+            order = np.random.RandomState(seed).permutation(len(self))
+        else:
+            order = np.arange(len(self))
+        return order[shard_id::num_shards][start:]
+
+    def iter_lines(self, order=None, encoding='utf-8'):
+        """
+        Yields lines (with their newline, as lines_from_file) in the given
+        order of line ids (see LineIndex.order), reading them from
+        memory-mapped files
+        """
+        import numpy as np
+        order = np.arange(len(self)) if order is None else np.asarray(order)
+        files = np.searchsorted(self.first_lines, order, side='right') - 1
+        offsets = self.offsets
+        maps = {}
+        try:
+            for line_id, f in zip(order.tolist(), files.tolist()):
+                if f not in maps:
+                    with open(self.sources[f][0], 'rb') as fh:
+                        maps[f] = mmap.mmap(
+                            fh.fileno(), 0, access=mmap.ACCESS_READ)
+                idx = self.starts[f] + line_id - self.first_lines[f]
+                start, end = int(offsets[idx]), int(offsets[idx + 1])
+                yield decode_line(maps[f][start:end], encoding)
+        finally:
+            for m in maps.values():
+                m.close()
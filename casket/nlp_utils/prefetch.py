@@ -0,0 +1,179 @@
+
+import pickle
+import queue
+import threading
+import traceback
+
+MODES = ('thread', 'process')
+
+_POLL = 0.1                     # seconds between checks for shutdown
+
+
+class RemoteTraceback(Exception):
+    """
+    Traceback of an exception raised in a producer process, set as the
+    cause of the exception re-raised by the consumer
+    """
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return '\n\n"""\n%s"""' % self.tb
+
+
+def _put(q, stop, item):
+    """
+    Blocks until `item` is queued, unless the consumer stops in between.
+    Returns whether the item was queued.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(factory, q, stop, pickled=False):
+    """
+    Producer loop, in a thread or in a process. Queue entries are tuples
+    tagged 'item', 'end' or 'error'. In a process, entries are pickled
+    here rather than by the queue's feeder thread, which would only log
+    pickling errors.
+    """
+    def pack(entry):
+        return pickle.dumps(entry, pickle.HIGHEST_PROTOCOL) if pickled \
+            else entry
+    try:
+        for item in factory():
+            if not _put(q, stop, pack(('item', item))):
+                return
+        _put(q, stop, pack(('end',)))
+    except BaseException as e:
+        tb = traceback.format_exc()
+        try:
+            entry = pack(('error', e, tb))
+        except Exception:   # unpicklable exception
+            entry = pack(('error', RuntimeError(repr(e)), tb))
+        _put(q, stop, entry)
+
+
+class Prefetcher(object):
+    """
+    Iterates over the items of `factory()`, produced in the background by
+    a thread or a process up to `depth` items ahead of the consumer, so
+    that producing items (e.g. reading and encoding batches) overlaps with
+    consuming them (e.g. training on them).
+
+    Exceptions raised by the producer are re-raised by the consumer (in
+    process mode, with the remote traceback as their cause). The producer
+    is stopped when the items run out, on close (or when leaving a with
+    block) and when the prefetcher is garbage-collected.
+
+    Example:
+    --------
+    with Prefetcher(lambda: corpus.generate_batches(indexer=indexer)) as b:
+        for contexts, targets in b:
+            ...
+
+    Parameters:
+    -----------
+    factory: function returning an iterable. In process mode, it must be
+        picklable unless processes are forked (e.g. a module-level function
+        or a bound method of a Corpus over files, see Corpus.prefetch).
+    depth: int, max number of items produced ahead
+    mode: str, one of 'thread' (cheap to start, items aren't copied, but
+        producing competes with the consumer for the GIL) or 'process'
+        (items are pickled through a pipe)
+    timeout: float, seconds to wait on close for a producer process to
+        stop before terminating it. Threads can't be terminated: closing
+        waits for the item being produced.
+    """
+    def __init__(self, factory, depth=4, mode='thread', timeout=5.0):
+        if mode not in MODES:
+            raise ValueError("Unknown mode [%s]" % str(mode))
+        if depth < 1:
+            raise ValueError("Prefetch depth must be positive")
+        self.mode = mode
+        self.timeout = timeout
+        if mode == 'thread':
+            self._queue = queue.Queue(maxsize=depth)
+            self._stop = threading.Event()
+            self._worker = threading.Thread(
+                target=_produce, args=(factory, self._queue, self._stop))
+        else:
+            import multiprocessing
+            self._queue = multiprocessing.Queue(maxsize=depth)
+            self._stop = multiprocessing.Event()
+            self._worker = multiprocessing.Process(
+                target=_produce,
+                args=(factory, self._queue, self._stop, True))
+        self._worker.daemon = True      # never block interpreter exit
+        self._closed = False
+        self._worker.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        while True:
+            try:
+                entry = self._queue.get(timeout=_POLL)
+                break
+            except queue.Empty:
+                if self._worker.is_alive():
+                    continue
+                try:            # the worker may have exited after a put
+                    entry = self._queue.get(timeout=_POLL)
+                    break
+                except queue.Empty:
+                    self.close()
+                    raise RuntimeError("Prefetching worker died")
+        if self.mode == 'process':
+            entry = pickle.loads(entry)
+        if entry[0] == 'item':
+            return entry[1]
+        self.close()
+        if entry[0] == 'error':
+            _, e, tb = entry
+            if self.mode == 'process':
+                raise e from RemoteTraceback(tb)
+            raise e
+        raise StopIteration
+
+    def close(self):
+        """
+        Stops the producer and waits for it to exit
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        # drain the queue so that a producer process can flush its pipe
+        waited = 0.0
+        while self._worker.is_alive():
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._worker.join(_POLL)
+            waited += _POLL
+            if self.mode == 'process' and waited >= self.timeout:
+                self._worker.terminate()    # e.g. stuck producing an item
+                self._worker.join()
+        if self.mode == 'process':
+            self._queue.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, '_closed', True):
+            self.close()
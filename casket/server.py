@@ -0,0 +1,275 @@
+# coding: utf-8
+
+"""
+Local live-results server.
+
+`DBCallback` publishes training events to `root + '/publish/...'`. This
+module provides those endpoints, together with a tailer over the db file,
+and fans out both kinds of updates to any number of subscribers over
+Server-Sent Events:
+
+    $ casket serve db.json --port 5000
+    $ curl -N http://localhost:5000/events
+
+Endpoints:
+----------
+POST /publish/<channel>/  form-encoded `data=<json>` (as sent by DBCallback)
+                          or a raw JSON body
+GET  /events              SSE stream of all published and tailed events
+GET  /status              JSON summary of subscribers and dropped events
+"""
+
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import parse_qs, urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, level=logging.INFO):
+    logger.log(level, msg)
+
+
+class Subscriber:
+    """
+    Bounded event queue for a single client. Publishing never blocks on a
+    slow client: once its queue is full the oldest pending event is dropped.
+    """
+    def __init__(self, maxsize=256):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class Broadcaster:
+    """
+    Fans out events to all current subscribers. Events are serialized once
+    and shared by every subscriber queue.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.subscribers = set()
+        self.last_id = 0
+
+    def subscribe(self):
+        sub = Subscriber(maxsize=self.maxsize)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+
+    def publish(self, channel, data):
+        self.last_id += 1
+        event = (self.last_id, channel, json.dumps(data))
+        for sub in self.subscribers:
+            sub.put(event)
+
+
+class StorageTailer:
+    """
+    Publishes what changed in the db file since the last poll. The file is
+    only parsed when its size or mtime change, and it is parsed once for all
+    subscribers, which only ever receive the new sessions and the newly
+    appended session results (e.g. epochs).
+
+    Parameters:
+    -----------
+    path: str, path to a local db file
+    broadcaster: Broadcaster
+    """
+    def __init__(self, path, broadcaster):
+        self.path = path
+        self.broadcaster = broadcaster
+        self._stat = None
+        self._seen = None       # (expId, modelId, session idx) -> counts
+
+    def changed(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime) != self._stat
+
+    def read(self):
+        """
+        Returns parsed db data and file stat, or None if the file couldn't
+        be parsed (e.g. it is being written)
+        """
+        try:
+            st = os.stat(self.path)
+            with open(self.path, 'r') as f:
+                return json.load(f), (st.st_size, st.st_mtime)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, data, stat):
+        first, self._stat = self._seen is None, stat
+        seen, self._seen = self._seen or {}, {}
+        for table in data.values():
+            for exp in table.values():
+                for model in exp.get("models", []):
+                    for idx, session in enumerate(model.get("sessions", [])):
+                        key = (exp.get("id"), model.get("modelId"), idx)
+                        self._seen[key] = self._diff(
+                            key, session, seen.get(key), publish=not first)
+
+    def _diff(self, key, session, seen, publish=True):
+        exp_id, model_id, idx = key
+        base = {"expId": exp_id, "modelId": model_id, "session": idx}
+        result, counts = session.get("result"), {}
+        if publish and seen is None:
+            self.broadcaster.publish("session", dict(
+                base, params=session.get("params"), meta=session.get("meta"),
+                result=result if not isinstance(result, dict) else None))
+        if not isinstance(result, dict):
+            return counts
+        for index, items in result.items():
+            if not isinstance(items, list):
+                continue
+            counts[index] = len(items)
+            start = (seen or {}).get(index, 0)
+            if publish and len(items) > start:
+                self.broadcaster.publish("result", dict(
+                    base, index=index, items=items[start:]))
+        return counts
+
+
+class Server:
+    """
+    Parameters:
+    -----------
+    path: str, path to the db file to tail
+    host: str
+    port: int, DBCallback publishes to port 5000 by default
+    interval: float, seconds between polls of the db file
+    maxsize: int, max number of pending events per subscriber
+    keepalive: float, seconds between keep-alive comments on idle streams
+    """
+    def __init__(self, path, host='localhost', port=5000, interval=1.0,
+                 maxsize=256, keepalive=15.0):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.keepalive = keepalive
+        self.broadcaster = Broadcaster(maxsize=maxsize)
+        self.tailer = StorageTailer(path, self.broadcaster)
+
+    async def tail(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            if self.tailer.changed():
+                # parse off the event loop, diff & publish on it
+                read = await loop.run_in_executor(None, self.tailer.read)
+                if read is not None:
+                    self.tailer.update(*read)
+            await asyncio.sleep(self.interval)
+
+    def publish(self, path, body, headers):
+        channel = path[len('/publish/'):].strip('/')
+        if headers.get('content-type', '').startswith('application/json'):
+            data = json.loads(body.decode('utf-8'))
+        else:
+            form = parse_qs(body.decode('utf-8'))
+            data = json.loads(form['data'][0]) if 'data' in form else {}
+        self.broadcaster.publish(channel, data)
+
+    def status(self):
+        subs = self.broadcaster.subscribers
+        return {"subscribers": len(subs),
+                "dropped": sum(sub.dropped for sub in subs),
+                "lastEventId": self.broadcaster.last_id}
+
+    async def stream(self, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Access-Control-Allow-Origin: *\r\n\r\n')
+        sub = self.broadcaster.subscribe()
+        try:
+            while True:
+                try:
+                    event_id, channel, data = await asyncio.wait_for(
+                        sub.queue.get(), self.keepalive)
+                    msg = 'id: %d\nevent: %s\ndata: %s\n\n' % (
+                        event_id, channel, data)
+                except asyncio.TimeoutError:
+                    msg = ': keep-alive\n\n'
+                writer.write(msg.encode('utf-8'))
+                await writer.drain()  # only this client waits on its socket
+        finally:
+            self.broadcaster.unsubscribe(sub)
+
+    @staticmethod
+    def respond(writer, status, body=b'', content_type='application/json'):
+        writer.write(('HTTP/1.1 %s\r\nContent-Type: %s\r\n'
+                      'Content-Length: %d\r\nConnection: close\r\n\r\n' % (
+                          status, content_type, len(body))).encode('latin-1'))
+        writer.write(body)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            method, target, _ = request.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(
+                int(headers.get('content-length', 0)))
+            path = urlsplit(target).path
+            if method == 'POST' and path.startswith('/publish/'):
+                try:
+                    self.publish(path, body, headers)
+                    self.respond(writer, '204 No Content')
+                except (ValueError, KeyError):
+                    self.respond(writer, '400 Bad Request')
+            elif method == 'GET' and path == '/events':
+                await self.stream(writer)
+            elif method == 'GET' and path == '/status':
+                self.respond(writer, '200 OK',
+                             json.dumps(self.status()).encode('utf-8'))
+            else:
+                self.respond(writer, '404 Not Found')
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        read = self.tailer.read()
+        if read is not None:
+            self.tailer.update(*read)  # prime without publishing history
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        log("Serving [%s] on http://%s:%d" % (
+            self.tailer.path, self.host, self.port))
+        tail = asyncio.ensure_future(self.tail())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            tail.cancel()
+
+
+def serve(path, host='localhost', port=5000, interval=1.0, maxsize=256):
+    """
+    Runs a live-results server on `path` until interrupted
+    """
+    server = Server(path, host=host, port=port, interval=interval,
+                    maxsize=maxsize)
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        pass
@@ -2,11 +2,15 @@
 
 import os
 import json
+import hashlib
 from getpass import getpass
 
 from paramiko import SSHClient, AutoAddPolicy
 from tinydb import Storage
 
+from .instrument import Instrument
+from .storage import ReadOnlyException, only_adds_tables, replace
+
 
 class WrongPathException(Exception):
     pass
@@ -32,9 +36,41 @@ def find_home(ssh):
     return stdout.readlines()[0].strip()
 
 
+def default_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'casket')
+
+
 class SFTPStorage(Storage):
-    def __init__(self, path, password=None, policy='default', **kwargs):
+    """
+    Storage for a db file on a remote host, accessed over SFTP.
+
+    Read-write storages download the file on every read. Read-only ones
+    download it once into a local snapshot in `cache_dir`, from which all
+    reads are served until `refresh` is called. Snapshots are only
+    downloaded again if the remote file changed (size or mtime), so they
+    are also reused across processes. Read-only storages never open the
+    remote file for writing.
+
+    Parameters:
+    -----------
+    path: str, username@host:/path/to/remote/file
+    password: str, optional, prompted for if missing
+    policy: str, 'autoadd' accepts unknown host keys
+    instrument: Instrument, optional
+    readonly: bool
+    cache_dir: str, directory for read-only snapshots,
+        defaults to ~/.cache/casket
+    kwargs: optional arguments for json.dumps
+    """
+    def __init__(self, path, password=None, policy='default',
+                 instrument=None, readonly=False, cache_dir=None, **kwargs):
+        self.url = path
         self.username, self.host, self.path = parse_url(path)
+        self.instrument = instrument or Instrument()
+        self.readonly = readonly
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.generation = 0     # of the read-only snapshot, see poll
+        self._snapshot, self._snapshot_stat = None, None
         self.kwargs = kwargs
         ssh = SSHClient()
         ssh.load_system_host_keys()
@@ -47,27 +83,99 @@ class SFTPStorage(Storage):
         self.sftp = ssh.open_sftp()
         if self.path.startswith('~'):
             self.path = os.path.join(find_home(self.ssh), self.path[2:])
-        self.sftp.open(self.path, mode='a').close()
-        self._handle = self.sftp.open(self.path, mode='r+')
+        if not readonly:
+            self.sftp.open(self.path, mode='a').close()
+
+    def snapshot_path(self):
+        digest = hashlib.sha1(self.url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(
+            self.cache_dir, digest + '-' + os.path.basename(self.path))
+
+    def refresh(self):
+        """
+        Updates the local snapshot of a read-only storage, downloading the
+        remote file only if it changed since the last download
+        """
+        try:
+            st = self.sftp.stat(self.path)
+        except IOError:         # not created yet
+            self._snapshot, self._snapshot_stat = None, None
+            return
+        stat = (st.st_size, int(st.st_mtime))
+        if stat == self._snapshot_stat:
+            return
+        local = self.snapshot_path()
+        try:
+            lst = os.stat(local)
+            fresh = (lst.st_size, int(lst.st_mtime)) == stat
+        except OSError:
+            fresh = False
+        if not fresh:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp = local + '.tmp'
+            with self.instrument.timer('read'):
+                self.sftp.get(self.path, tmp)
+            os.utime(tmp, (st.st_atime, st.st_mtime))
+            replace(tmp, local)
+            self.instrument.add_bytes('read', st.st_size)
+        with open(local, 'r') as f:
+            self._snapshot = f.read()
+        self._snapshot_stat = stat
+        self.generation += 1
+
+    def poll(self):
+        """
+        Returns the generation of the read-only snapshot (see
+        AtomicJSONStorage.poll), or None for read-write storages, which
+        download the file on every read
+        """
+        if not self.readonly:
+            return None
+        if self._snapshot_stat is None:
+            self.refresh()
+        return self.generation
 
     def read(self):
-        self._handle.seek(0, 2)
-        size = self._handle.tell()
-        if not size:
+        if self.readonly:
+            if self._snapshot_stat is None:
+                self.refresh()
+            else:
+                self.instrument.count('cache_hit')
+            if not self._snapshot:
+                return None
+            # parsed on each read, so that readers can't change the snapshot
+            with self.instrument.timer('deserialize'):
+                return json.loads(self._snapshot)
+        # reopen on each read, since writes replace the remote file
+        with self.instrument.timer('read'):
+            with self.sftp.open(self.path, mode='r') as f:
+                content = f.read()
+        self.instrument.add_bytes('read', len(content))
+        if not content:
             return None
-        else:
-            self._handle.seek(0)
-            return json.loads(self._handle.read().decode('utf-8'))
+        with self.instrument.timer('deserialize'):
+            return json.loads(content.decode('utf-8'))
 
     def write(self, data):
-        self._handle.seek(0)
-        serialized = json.dumps(data, **self.kwargs)
-        self._handle.write(serialized)
-        self._handle.flush()
-        self._handle.truncate(self._handle.tell())
+        """
+        Uploads to a temporary file next to the db file, which then replaces
+        it atomically, so that an interrupted upload can't corrupt the db
+        """
+        if self.readonly:
+            if not only_adds_tables(data, self._snapshot):
+                raise ReadOnlyException("Can't write to read-only db")
+            self._snapshot = json.dumps(data, **self.kwargs)
+            return
+        with self.instrument.timer('serialize'):
+            serialized = json.dumps(data, **self.kwargs)
+        tmp = self.path + '.tmp'
+        with self.instrument.timer('write'):
+            with self.sftp.open(tmp, mode='w') as f:
+                f.write(serialized)
+            self.sftp.posix_rename(tmp, self.path)
+        self.instrument.add_bytes('write', len(serialized))
 
     def close(self):
-        self._handle.close()
-        self.ssh.close()
         self.sftp.close()
-
+        self.ssh.close()
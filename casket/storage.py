@@ -0,0 +1,356 @@
+# coding: utf-8
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from tinydb import TinyDB, Storage
+
+from .instrument import Instrument
+
+
+FSYNC_MODES = ('always', 'interval', 'never')
+
+# Version of the db layout written by this version of casket. It is stored
+# in table SCHEMA_TABLE of new dbs; dbs without it are version 1 (see migrate)
+SCHEMA_VERSION = 1
+SCHEMA_TABLE = '_casket'
+
+# Key of the session result under which results added without `index_by`
+# are stored (the JSON form of None, which earlier versions used)
+UNINDEXED_KEY = 'null'
+
+
+class SchemaVersionException(Exception):
+    pass
+
+
+class FormatException(Exception):
+    pass
+
+
+class ReadOnlyException(Exception):
+    pass
+
+
+replace = getattr(os, 'replace', os.rename)  # os.rename is atomic on POSIX
+
+
+def only_adds_tables(data, content):
+    """
+    Checks whether `data` only differs from `content` (the serialized data
+    read before) by new empty tables, as written by TinyDB on access to a
+    missing table. Read-only storages accept such writes in memory.
+    """
+    last = json.loads(content) if content else {}
+    if any(name not in data for name in last):
+        return False
+    # compare as serialized, since TinyDB writes doc ids as ints
+    data = json.loads(json.dumps(data))
+    return all(last[name] == table if name in last else not table
+               for name, table in data.items())
+
+
+def fsync_dir(dirname):
+    """
+    Flushes a directory entry (e.g. after a rename) to disk, where supported
+    """
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:             # e.g. Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class AtomicJSONStorage(Storage):
+    """
+    JSON file storage that never leaves a partially written db behind
+    when the process crashes. Data is written to a temporary file in the
+    same directory which then atomically replaces the db file, so a crash
+    of the process leaves either the old or the new version of the db.
+    Surviving a power loss or an OS crash also requires the new file to
+    be on disk before it replaces the old one, which only 'always' mode
+    guarantees.
+
+    The last data read or written is kept in memory (serialized) and read
+    from there as long as the file is unchanged. Since every write replaces
+    the file, changes by other processes are detected from its inode, size
+    and mtime. Each read returns new objects, so that changes made by
+    callers to the data they read never reach other readers (nor the file,
+    unless written). `generation` is incremented whenever the data
+    changes, so that callers can cache anything derived from it (see
+    poll). Read-only storages never create nor write the file.
+
+    Parameters:
+    -----------
+    path: str, path to the db file (created if it doesn't exist)
+    fsync: str, one of 'always', 'interval', 'never'. Durability mode:
+        'always' flushes each write to disk before it replaces the db, so
+            the db survives power loss.
+        'interval' flushes at most once every `fsync_interval` seconds.
+            A process crash can't corrupt the db, but on power loss any
+            write since the last flush may leave an empty or truncated db.
+        'never' leaves flushing to the OS, with the same risk on power
+            loss as 'interval'.
+    fsync_interval: float, seconds between flushes in 'interval' mode
+    instrument: Instrument, optional, records I/O and (de)serialization
+    cache: bool, keep the data in memory between reads
+    readonly: bool, raise ReadOnlyException on writes
+    kwargs: optional arguments for json.dumps
+    """
+    def __init__(self, path, fsync='always', fsync_interval=5.0,
+                 instrument=None, cache=True, readonly=False, **kwargs):
+        if fsync not in FSYNC_MODES:
+            raise ValueError("Unknown fsync mode [%s]" % str(fsync))
+        super(AtomicJSONStorage, self).__init__()
+        self.path = os.path.realpath(path)
+        self.dirname = os.path.dirname(self.path)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.instrument = instrument or Instrument()
+        self.cache = cache
+        self.readonly = readonly
+        self.kwargs = kwargs
+        self._last_sync = time.time()
+        self._content, self._cached_stat = None, None
+        self.generation = 0
+        if not readonly and not os.path.exists(self.path):
+            open(self.path, 'a').close()
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _should_sync(self):
+        if self.fsync == 'interval':
+            return time.time() - self._last_sync >= self.fsync_interval
+        return self.fsync == 'always'
+
+    def read(self):
+        content = self._load()
+        if not content:
+            return None
+        with self.instrument.timer('deserialize'):
+            return json.loads(content)
+
+    def poll(self):
+        """
+        Returns the generation of the data, reading the file only if it
+        changed (but without deserializing it)
+        """
+        self._load()
+        return self.generation
+
+    def _load(self):
+        """
+        Returns the serialized data, from memory if the file is unchanged
+        """
+        stat = self._stat(self.path) if self.cache else None
+        if stat is not None and stat == self._cached_stat:
+            self.instrument.count('cache_hit')
+            return self._content
+        # reopen on each read, since writes replace the file
+        with self.instrument.timer('read'):
+            try:
+                with open(self.path, 'r') as f:
+                    content = f.read()
+            except IOError:
+                if not self.readonly:
+                    raise
+                content = ''    # not created yet
+        self.instrument.add_bytes('read', len(content))
+        if content != self._content:
+            self.generation += 1
+        self._content, self._cached_stat = content, stat
+        return content
+
+    def refresh(self):
+        """
+        Drops the in-memory data, so that the next read hits the file
+        """
+        self._content, self._cached_stat = None, None
+
+    def write(self, data):
+        if self.readonly:
+            if not only_adds_tables(data, self._content):
+                raise ReadOnlyException("Can't write to read-only db")
+            self._content = json.dumps(data, **self.kwargs)
+            self.generation += 1
+            return
+        with self.instrument.timer('serialize'):
+            serialized = json.dumps(data, **self.kwargs)
+        sync = self._should_sync()
+        with self.instrument.timer('write'):
+            fd, tmp = tempfile.mkstemp(
+                prefix='.' + os.path.basename(self.path) + '.',
+                suffix='.tmp', dir=self.dirname)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(serialized)
+                    f.flush()
+                    if sync:
+                        os.fsync(f.fileno())
+                if os.path.exists(self.path):  # mkstemp creates files as 0600
+                    os.chmod(tmp, os.stat(self.path).st_mode & 0o7777)
+                stat = self._stat(tmp) if self.cache else None
+                replace(tmp, self.path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            if sync:
+                fsync_dir(self.dirname)
+                self._last_sync = time.time()
+        self.instrument.add_bytes('write', len(serialized))
+        if self.cache:
+            self._content, self._cached_stat = serialized, stat
+        self.generation += 1
+
+
+def schema_version(data):
+    """
+    Returns the schema version of db data (as returned by Storage.read)
+    """
+    for doc in ((data or {}).get(SCHEMA_TABLE) or {}).values():
+        return doc.get("schema", 1)
+    return 1
+
+
+def check_schema(db, readonly=False):
+    """
+    Raises SchemaVersionException if `db` doesn't use the current layout,
+    and marks new (empty) dbs with the current schema version. Read-only
+    dbs are left as they are, since readers handle all layouts (see
+    migrate.get_epochs).
+    """
+    if readonly:
+        return
+    data = db.storage.read() or {}
+    version = schema_version(data)
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionException(
+            "db has schema version %d but version %d is required. "
+            "See `casket migrate`" % (version, SCHEMA_VERSION))
+    if SCHEMA_TABLE not in data and not any(data.values()):
+        db.table(SCHEMA_TABLE).insert({"schema": SCHEMA_VERSION})
+
+
+def check_format(path):
+    """
+    Raises FormatException if the local db at `path` isn't a json db
+    """
+    from .migrate import detect_format
+    if not os.path.isfile(path) or not os.path.getsize(path):
+        return
+    fmt = detect_format(path)
+    if fmt != 'json':
+        raise FormatException(
+            "db [%s] is in %s format, which can't be opened. Migrate it "
+            "back with `casket migrate %s <target> --format json`" % (
+                path, fmt, path))
+
+
+def open_db(path, fsync='always', instrument=None, readonly=False,
+            **kwargs):
+    """
+    Opens a TinyDB on `path`, which can be a local file or a remote one
+    using syntax username@host:/path/to/remote/file (see sftp_storage).
+
+    Parameters:
+    -----------
+    path: str
+    fsync: str, durability mode of local files (see AtomicJSONStorage).
+        Remote files are always replaced atomically, but their durability
+        is up to the remote host.
+    instrument: Instrument, optional, see instrument.Instrument
+    readonly: bool, open a read-only db. Remote dbs are then downloaded
+        once into a local snapshot (see SFTPStorage).
+    kwargs: optional arguments for the storage
+
+    Raises FormatException for local dbs in other formats than json (see
+    migrate.FORMATS), which must be migrated back to json first.
+    """
+    db = None
+    try:
+        from .sftp_storage import SFTPStorage, WrongPathException
+    except ImportError:
+        if '@' in path:
+            from warnings import warn
+            warn("""`paramiko` doesn't seem to be installed in your OS.
+            Remote db access is disabled""", ImportWarning)
+    else:
+        try:
+            db = TinyDB(path, policy='autoadd', storage=SFTPStorage,
+                        instrument=instrument, readonly=readonly, **kwargs)
+        except WrongPathException:
+            pass
+    if db is None:
+        check_format(path)
+        db = TinyDB(path, storage=AtomicJSONStorage, fsync=fsync,
+                    instrument=instrument, readonly=readonly, **kwargs)
+    try:
+        check_schema(db, readonly=readonly)
+    except SchemaVersionException:
+        db.close()
+        raise
+    return db
+
+
+# process-wide registry of open dbs: (key, readonly) -> [TinyDB, handles]
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_key(path):
+    return path if '@' in path else os.path.realpath(path)
+
+
+def acquire(path, **kwargs):
+    """
+    Returns the TinyDB shared by all handles on `path` in the current
+    process (and therefore its storage and in-memory cache), opening it on
+    first use. Options are only used when the db is opened, so the first
+    handle on a path determines them (read-only handles are kept apart
+    from read-write ones). Each call must be paired with a call
+    to `release` once the handle is no longer used.
+
+    Parameters:
+    -----------
+    path: str
+    kwargs: optional arguments for open_db
+    """
+    key = (_registry_key(path), bool(kwargs.get('readonly')))
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is None:
+            entry = _registry[key] = [open_db(path, **kwargs), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release(db):
+    """
+    Releases a handle obtained with `acquire`, closing the db once all
+    handles on its path have been released
+    """
+    with _registry_lock:
+        for key, entry in _registry.items():
+            if entry[0] is db:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _registry[key]
+                    db.close()
+                return
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+import os
+import sys
+import threading
+import time
+
+
+def current_rss():
+    """
+    Returns current resident set size in bytes or None if unavailable
+    (only supported on systems providing /proc, e.g. Linux)
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the process over its whole
+    lifetime in bytes, or None if unavailable
+    """
+    try:
+        import resource
+    except ImportError:         # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # kB on Linux
+
+
+class Telemetry(object):
+    """
+    Collects wall time, CPU time and peak memory of a block of code, plus
+    periodic samples of elapsed time, CPU time and RSS taken by a daemon
+    thread. Nothing is written while running; `stop` returns everything as
+    a single serializable dict (see Model.session).
+
+    The peak memory of the block is the highest RSS sampled while it runs
+    (including at start and stop), or the process's lifetime peak if the
+    block raised it, so that blocks following a memory-heavy one don't
+    inherit its peak.
+
+    To keep memory and overhead bounded on long runs, whenever `max_samples`
+    is reached every other sample is dropped and the interval is doubled.
+
+    Parameters:
+    -----------
+    interval: float, seconds between samples. None disables sampling.
+    max_samples: int
+    """
+    def __init__(self, interval=10.0, max_samples=100):
+        self.interval = interval
+        self.max_samples = max_samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _track(self, rss):
+        if rss is not None and (self._peak is None or rss > self._peak):
+            self._peak = rss
+        return rss
+
+    def _sample(self):
+        self.samples.append((round(time.time() - self._wall, 3),
+                             round(time.process_time() - self._cpu, 3),
+                             self._track(current_rss())))
+        if len(self.samples) >= self.max_samples:
+            self.samples = self.samples[::2]
+            self._interval *= 2
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def start(self):
+        self.samples, self._interval = [], self.interval
+        self._peak = None
+        self._start_rss = self._track(current_rss())
+        self._start_maxrss = peak_rss()
+        self._wall, self._cpu = time.time(), time.process_time()
+        self._stop.clear()
+        if self.interval:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Returns:
+        --------
+        dict with wall_time and cpu_time in seconds, start_rss and peak_rss
+        (of the block) in bytes and samples as columns (elapsed, cpu, rss)
+        """
+        wall_time = time.time() - self._wall
+        cpu_time = time.process_time() - self._cpu
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._track(current_rss())
+        maxrss = peak_rss()
+        if maxrss is not None and self._start_maxrss is not None and \
+                maxrss > self._start_maxrss:
+            self._track(maxrss)     # the block set a new process peak
+        elapsed, cpu, rss = zip(*self.samples) if self.samples else ((),) * 3
+        return {"wall_time": wall_time,
+                "cpu_time": cpu_time,
+                "start_rss": self._start_rss,
+                "peak_rss": self._peak,
+                "samples": {"interval": self._interval,
+                            "elapsed": list(elapsed),
+                            "cpu": list(cpu),
+                            "rss": list(rss)}}
@@ -1,8 +1,11 @@
 
+import hashlib
 import inspect
+import json
 import os
 from datetime import datetime
 from contextlib import contextmanager
+from itertools import product
 import sys
 
 
@@ -65,6 +68,74 @@ def make_hash(o):
     return hash(freeze(o))
 
 
+def params_hash(params):
+    """
+    Returns a stable hex digest of a serializable object. Unlike `make_hash`
+    it doesn't depend on the running process, and dict keys are sorted.
+
+    >>> params_hash({'a': 1, 'b': [1, 2]})
+    '361f641e03db100169275cd90f4c15a1ebb42045'
+    >>> assert params_hash({'a': 1, 'b': 2}) == params_hash({'b': 2, 'a': 1})
+    """
+    serialized = json.dumps(params, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(serialized).hexdigest()
+
+
+def from_cv_results(cv_results):
+    """
+    Converts sklearn's `cv_results_` (a dict of columns with one entry per
+    grid point) into a list of serializable dicts, one per grid point,
+    e.g. for Model.add_results. NumPy arrays and scalars are converted to
+    python types and masked entries to None.
+
+    >>> from_cv_results({'params': [{'C': 1}, {'C': 10}],
+    ...                  'mean_test_score': [0.5, 0.7]})
+    [{'params': {'C': 1}, 'mean_test_score': 0.5}, \
+{'params': {'C': 10}, 'mean_test_score': 0.7}]
+    """
+    def plain(value):
+        if isinstance(value, dict):
+            return {k: plain(v) for k, v in value.items()}
+        if hasattr(value, 'item') and not isinstance(value, (list, tuple)):
+            return value.item()  # NumPy scalar
+        return value
+    rows = [{} for _ in cv_results['params']]
+    for key, values in cv_results.items():
+        if hasattr(values, 'tolist'):
+            values = values.tolist()  # NumPy (masked) array
+        for row, value in zip(rows, values):
+            row[key] = plain(value)
+    return rows
+
+
+def pack_records(records):
+    """
+    Converts a list of dicts into a dict of columns, filling in None for
+    keys missing in a record (see unpack_records)
+
+    >>> pack_records([{'epoch_num': 1, 'loss': 0.5}, {'epoch_num': 2}])
+    {'epoch_num': [1, 2], 'loss': [0.5, None]}
+    """
+    keys = []
+    for record in records:
+        keys.extend(k for k in record if k not in keys)
+    return {k: [record.get(k) for record in records] for k in keys}
+
+
+def unpack_records(columns):
+    """
+    Converts a dict of columns back into a list of dicts. None values are
+    considered missing and left out (see pack_records)
+
+    >>> unpack_records({'epoch_num': [1, 2], 'loss': [0.5, None]})
+    [{'epoch_num': 1, 'loss': 0.5}, {'epoch_num': 2}]
+    """
+    n = max([len(column) for column in columns.values()] or [0])
+    return [{k: column[i] for k, column in columns.items()
+             if i < len(column) and column[i] is not None}
+            for i in range(n)]
+
+
 def merge(d1, d2):
     """
     Merges two dictionaries, nested values are overwitten by d1
@@ -77,6 +148,27 @@ def merge(d1, d2):
     return dict(d1, **d2)
 
 
+def param_grid(grid):
+    """
+    Expands a grid of parameters into the list of all combinations, following
+    the semantics of sklearn's ParameterGrid: `grid` maps param names to lists
+    of values, or is a list of such dicts (whose expansions are concatenated).
+
+    >>> param_grid({'a': [1, 2], 'b': ['x']})
+    [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'x'}]
+    >>> param_grid([{'a': [1]}, {'b': [True, False]}])
+    [{'a': 1}, {'b': True}, {'b': False}]
+    """
+    if isinstance(grid, dict):
+        grid = [grid]
+    combinations = []
+    for subgrid in grid:
+        keys = sorted(subgrid)
+        for values in product(*[subgrid[k] for k in keys]):
+            combinations.append(dict(zip(keys, values)))
+    return combinations
+
+
 def update_in(d, path, f, *args):
     """
     Parameters:
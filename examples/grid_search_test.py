@@ -8,6 +8,7 @@ from sklearn.metrics import precision_recall_fscore_support
 from sklearn.svm import SVC
 
 from casket import Experiment as E
+from casket.utils import from_cv_results
 
 digits = datasets.load_digits()
 
@@ -34,13 +35,8 @@ with model.session({'grid_params': grid_params}) as session:
         # add best params in dev set
         session.add_result({'best_params': clf.best_params_}, index_by=score)
 
-        means = clf.cv_results_['mean_test_score']
-        stds = clf.cv_results_['std_test_score']
-        for mean, std, params in zip(means, stds, clf.cv_results_['params']):
-            # add partial grid search result alongside params
-            result = {'grid_search_params': params,
-                      'dev_scores': {'mean': mean, 'std': std}}
-            session.add_result(result, index_by=score)
+        # add all partial grid search results (one per params) at once
+        session.add_results(from_cv_results(clf.cv_results_), index_by=score)
 
         y_true, y_pred = y_test, clf.predict(X_test)
         p, r, f, _ = precision_recall_fscore_support(y_true, y_pred)
@@ -0,0 +1,24 @@
+# coding: utf-8
+
+from casket.nlp_utils import Corpus, Indexer
+
+
+def test_array_batches_can_be_kept():
+    text = ['abcdefghij' * 3 + '\n'] * 5
+    indexer = Indexer()
+    indexer.fit(c for line in text for c in line)
+
+    def batches(**kwargs):
+        corpus = Corpus((line for line in text), context=3)
+        return corpus.generate_array_batches(
+            batch_size=20, mode='chars', indexer=indexer, **kwargs)
+
+    # consumers queueing batches (e.g. fit_generator) get distinct batches
+    kept = list(batches())
+    copies = [(c.copy(), t.copy()) for c, t in batches()]
+    assert len(kept) == len(copies) > 2
+    for (contexts, targets), (c, t) in zip(kept, copies):
+        assert (contexts == c).all() and (targets == t).all()
+    # a ring of reused buffers yields views, valid until they are reused
+    ring = list(batches(buffers=2))
+    assert ring[0][1] is ring[2][1]
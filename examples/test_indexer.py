@@ -0,0 +1,34 @@
+# coding: utf-8
+
+import itertools
+import pickle
+import string
+
+from casket.nlp_utils import HashingIndexer
+
+
+def collisions(indexer, items):
+    buckets = {}
+    for item in items:
+        buckets.setdefault(indexer.encode(item), []).append(item)
+    return set(pair for bucket in buckets.values()
+               for pair in itertools.combinations(bucket, 2))
+
+
+def test_hashing_seeds_are_independent():
+    # same-length items, whose crc32 collisions don't depend on the seed
+    items = [''.join(p) for p in itertools.product(string.ascii_lowercase,
+                                                   repeat=3)]
+    pairs = [collisions(HashingIndexer(n_buckets=1 << 12, seed=seed), items)
+             for seed in (0, 12345)]
+    assert pairs[0] and pairs[1]
+    assert len(pairs[0] & pairs[1]) < 0.1 * len(pairs[0])
+
+
+def test_hashing_pickle():
+    indexer = HashingIndexer(n_buckets=1000, seed=7)
+    indexer.encode_seq(['a', 'b'])
+    copy = pickle.loads(pickle.dumps(indexer))
+    assert copy.encode_seq(['a', 'b', 'c']) == \
+        HashingIndexer(n_buckets=1000, seed=7).encode_seq(['a', 'b', 'c'])
+    assert copy.vocab_hash() == indexer.vocab_hash()
@@ -0,0 +1,174 @@
+# coding: utf-8
+
+import json
+
+import pytest
+
+from tinydb import TinyDB, where
+
+from casket.storage import AtomicJSONStorage, FormatException, \
+    ReadOnlyException, open_db
+
+
+def read_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_read_returns_copies(tmpdir):
+    path = str(tmpdir.join('db.json'))
+    storage = AtomicJSONStorage(path)
+    storage.write({'_default': {'1': {'sessions': [1]}}})
+    data = storage.read()
+    data['_default']['1']['sessions'].append(2)
+    assert storage.read() == {'_default': {'1': {'sessions': [1]}}}
+
+
+def test_changed_documents_arent_written(tmpdir):
+    """
+    Regression test: changes to documents returned by the db must not leak
+    into later reads, nor into the file on the next unrelated write
+    """
+    path = str(tmpdir.join('db.json'))
+    db = TinyDB(path, storage=AtomicJSONStorage)
+    db.insert({'id': 'exp', 'sessions': [1], 'tags': []})
+    doc = db.get(where('id') == 'exp')
+    doc['sessions'].append(2)
+    assert db.get(where('id') == 'exp')['sessions'] == [1]
+    db.update({'tags': ['tag']}, where('id') == 'exp')
+    assert read_file(path)['_default']['1']['sessions'] == [1]
+
+
+def test_readonly(tmpdir):
+    path = str(tmpdir.join('db.json'))
+    TinyDB(path, storage=AtomicJSONStorage).insert({'id': 'exp', 'n': [1]})
+    db = TinyDB(path, storage=AtomicJSONStorage, readonly=True)
+    db.table('missing').all()   # TinyDB adds missing tables on read
+    doc = db.get(where('id') == 'exp')
+    doc['n'].append(2)
+    assert db.get(where('id') == 'exp')['n'] == [1]
+    with pytest.raises(ReadOnlyException):
+        db.insert({'id': 'other'})
+    assert read_file(path) == {'_default': {'1': {'id': 'exp', 'n': [1]}}}
+
+
+def test_experiment_documents_are_copies(tmpdir):
+    from casket import Experiment
+    path = str(tmpdir.join('db.json'))
+    with Experiment.use(path, exp_id='exp', profile=True) as exp:
+        exp.model('model').add_result({'acc': 0.5}, params={'seed': 1})
+        exp.get_models()[0]['sessions'].append({'params': {'seed': 2}})
+        assert len(exp.get_models()[0]['sessions']) == 1
+        exp.add_tag('tag')
+        sessions = read_file(path)['_default']['1']['models'][0]['sessions']
+        assert len(sessions) == 1
+        # unchanged file: served from memory, not read again
+        reads = exp.stats().get('read', {}).get('count', 0)
+        exp.get_models()
+        assert exp.stats().get('read', {}).get('count', 0) == reads
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'sqlite'])
+def test_open_migrated_db(tmpdir, fmt):
+    from casket import migrate
+    path = str(tmpdir.join('db.json'))
+    TinyDB(path, storage=AtomicJSONStorage).insert({'id': 'exp'})
+    migrated, back = str(tmpdir.join('db.' + fmt)), str(tmpdir.join('back'))
+    migrate.migrate(path, migrated, fmt=fmt)
+    for readonly in (False, True):
+        with pytest.raises(FormatException, match=fmt):
+            open_db(migrated, readonly=readonly)
+    migrate.migrate(migrated, back, fmt='json')
+    db = open_db(back)
+    assert db.all() == [{'id': 'exp'}]
+    db.close()
+
+
+def add_sessions(path):
+    from casket import Experiment
+    with Experiment.use(path, exp_id='exp') as exp:
+        model = exp.model('model')
+        with model.session({'seed': 1}) as session:
+            session.add_result({'acc': 0.5})
+            session.add_epoch(1, {'loss': 0.3})
+            session.add_results([{'acc': 0.6}, {'acc': 0.7}])
+        with model.session({'seed': 2}) as session:
+            session.add_epoch(1, {'loss': 0.2}, timestamp=False)
+            session.add_result({'acc': 0.8})
+            session.add_results([{'f1': 0.1}], index_by='test')
+        return model.get_sessions()
+
+
+def test_session_results_with_epochs(tmpdir):
+    first, second = add_sessions(str(tmpdir.join('db.json')))
+    assert first['result']['null'] == [
+        {'acc': 0.5}, {'acc': 0.6}, {'acc': 0.7}]
+    assert [e['loss'] for e in first['result']['epochs']] == [0.3]
+    assert second['result'] == {
+        'epochs': [{'loss': 0.2, 'epoch_num': 1}], 'null': [{'acc': 0.8}],
+        'test': [{'f1': 0.1}]}
+
+
+def test_session_results_in_cli(tmpdir, capsys):
+    from casket.cli import main
+    path = str(tmpdir.join('db.json'))
+    add_sessions(path)
+    main(['top', path, '--metric', 'acc'])
+    top = [line.split('\t') for line in capsys.readouterr().out.split('\n')
+           if line]
+    assert [(row[1], json.loads(row[4])) for row in top] == [
+        ('0.8', {'seed': 2}), ('0.7', {'seed': 1})]
+    main(['top', path, '--metric', 'loss', '--min'])
+    assert capsys.readouterr().out.split('\t')[1] == '0.2'
+    main(['export', path])
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()
+            if line]
+    assert [(row['acc'], row.get('f1')) for row in rows] == [
+        (0.7, None), (0.8, 0.1)]
+
+
+def test_cached_call_sees_new_sessions(tmpdir):
+    from casket import Experiment
+    path = str(tmpdir.join('db.json'))
+    calls = []
+
+    def f(c):
+        calls.append(c)
+        return {'acc': c}
+
+    with Experiment.use(path, exp_id='exp') as exp:
+        model = exp.model('model')
+        assert model.cached_call(f, {'c': 1}) == {'acc': 1}
+        assert model.cached_call(f, {'c': 1}) == {'acc': 1}
+        model.add_result({'acc': 2}, params={'c': 2})
+        assert model.cached_call(f, {'c': 2}) == {'acc': 2}
+        # sessions added through another handle
+        other = TinyDB(path, storage=AtomicJSONStorage)
+        doc = other.get(where('id') == 'exp')
+        doc['models'][0]['sessions'].append(
+            {'params': {'c': 3}, 'meta': {}, 'result': {'acc': 3}})
+        other.update({'models': doc['models']}, where('id') == 'exp')
+        other.close()
+        assert model.cached_call(f, {'c': 3}) == {'acc': 3}
+        assert calls == [1]
+        assert [s['params']['c'] for s in model.get_sessions()] == [1, 2, 3]
+
+
+def slow_or_failing(x):
+    import time
+    if x == 0:
+        raise ValueError("failed")
+    time.sleep(0.5)
+    return {'x': x}
+
+
+def test_run_grid_keeps_finished_results(tmpdir):
+    from casket import Experiment
+    path = str(tmpdir.join('db.json'))
+    with Experiment.use(path, exp_id='exp') as exp:
+        with pytest.raises(ValueError):
+            exp.run_grid('model', slow_or_failing, {'x': [0, 1, 2, 3]},
+                         n_jobs=3)
+        # 1 and 2 were running when 0 failed (3 may have started too)
+        done = [s['params']['x'] for s in exp.model('model').get_sessions()]
+        assert {1, 2} <= set(done) and 0 not in done
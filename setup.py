@@ -19,6 +19,9 @@ setup(
         'tinydb>=3.2.1'
     ],
     packages=['casket', 'casket.nlp_utils'],
+    entry_points={
+        'console_scripts': ['casket = casket.cli:main']
+    },
     url='https://www.github.com/emanjavacas/casket',
     download_url=url,
     description='Persistent storage for ML experiments',